@@ -1,18 +1,29 @@
-from flask import Flask, render_template, redirect, url_for, session, request, flash, jsonify
+from flask import Flask, render_template, redirect, url_for, session, request, flash, jsonify, g, Response, get_template_attribute, stream_template
 from flask_cors import CORS
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
 import os
 import json
+import base64
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from email_follow_up import EmailFollowUpSystem
 import config
-from msal import ConfidentialClientApplication
 from outlook_follow_up import OutlookFollowUpSystem
+from async_outlook_follow_up import AsyncOutlookFollowUpSystem
 import logging
 from datetime import datetime
-from urllib.parse import quote
 import requests
 from whatsapp_follow_up import WhatsAppFollowUpSystem
+from sync_state import SyncStateStore
+from classification import ClassificationEngine, load_rules
+import graph_session
+from report_jobs import ReportJobRunner
+from report_cache import ReportCache
+import metrics
+from session_store import SQLiteSessionInterface, SQLiteSessionStore
+from token_manager import TokenManager, TokenError, credentials_to_dict
 
 app = Flask(__name__)
 CORS(app)
@@ -27,16 +38,23 @@ app.config.update(
     SESSION_USE_SIGNER=True
 )
 
-# Initialize Flask-Session
-from flask_session import Session
-Session(app)
+if config.SESSION_BACKEND == 'sqlite':
+    # One SQLite file shared by every worker, read only when a request uses the session
+    app.session_interface = SQLiteSessionInterface(
+        SQLiteSessionStore(config.SESSION_DB_PATH, cleanup_interval=config.SESSION_CLEANUP_INTERVAL)
+    )
+else:
+    # Initialize Flask-Session
+    from flask_session import Session
+    Session(app)
 
 # Disable OAuthlib's HTTPS verification in local development
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=config.LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s %(message)s')
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('recap.access')
 
 # Enable session cookie security
 app.config.update(
@@ -45,25 +63,55 @@ app.config.update(
     SESSION_COOKIE_SAMESITE='Lax'
 )
 
-def credentials_to_dict(credentials):
-    return {
-        'token': credentials.token,
-        'refresh_token': credentials.refresh_token,
-        'token_uri': credentials.token_uri,
-        'client_id': credentials.client_id,
-        'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
-    }
+# Shared by every request so incremental syncs resume where the last report stopped
+sync_state_store = SyncStateStore(config.SYNC_STATE_DIR)
+
+# /metrics adds up the values every worker writes here
+metrics.REGISTRY.configure(config.METRICS_DIR, flush_interval=config.METRICS_FLUSH_INTERVAL)
+
+# Every Outlook report in this worker shares one pooled Graph session
+graph_session.configure(
+    pool_size=config.GRAPH_POOL_SIZE,
+    connect_timeout=config.GRAPH_CONNECT_TIMEOUT,
+    read_timeout=config.GRAPH_READ_TIMEOUT
+)
+
+# Compile the follow-up rules once for every report both providers generate
+classifier = ClassificationEngine(
+    load_rules(config.CLASSIFICATION_RULES_FILE) if config.CLASSIFICATION_RULES_FILE else None
+)
+
+# Generated reports are shared by every worker process through a local SQLite file
+report_cache = ReportCache(
+    config.REPORT_CACHE_PATH,
+    ttl=config.REPORT_CACHE_TTL,
+    max_stale=config.REPORT_CACHE_MAX_STALE,
+    max_entries=config.REPORT_CACHE_MAX_ENTRIES
+)
+
+# Reports are generated in the background so slow mailboxes don't hold up request workers;
+# their status is kept next to the report cache so any worker can answer a poll
+report_jobs = ReportJobRunner(
+    config.REPORT_CACHE_PATH,
+    max_workers=config.REPORT_WORKERS,
+    result_ttl=config.REPORT_JOB_TTL
+)
+# Each report job runs its providers side by side on this pool
+provider_pool = ThreadPoolExecutor(max_workers=config.REPORT_WORKERS * 3, thread_name_prefix='report-provider')
+
+# One MSAL app and token cache for the process; tokens are refreshed ahead of expiry in the background
+token_manager = TokenManager(
+    config.MS_CLIENT_ID,
+    config.MS_CLIENT_SECRET,
+    config.MS_AUTHORITY,
+    config.MS_GRAPH_SCOPES,
+    config.MS_REDIRECT_URI,
+    config.TOKEN_CACHE_PATH,
+    refresh_margin=config.TOKEN_REFRESH_MARGIN,
+    refresh_interval=config.TOKEN_REFRESH_INTERVAL,
+    idle_ttl=config.TOKEN_IDLE_TTL
+)
 
-def credentials_from_dict(credentials_dict):
-    return Credentials(
-        token=credentials_dict['token'],
-        refresh_token=credentials_dict['refresh_token'],
-        token_uri=credentials_dict['token_uri'],
-        client_id=credentials_dict['client_id'],
-        client_secret=credentials_dict['client_secret'],
-        scopes=credentials_dict['scopes']
-    )
 
 @app.route('/')
 def index():
@@ -160,17 +208,7 @@ def authorize_outlook():
         print(f"Session after storing state: {session}")  # Debug print
         
         # Construct authorization URL
-        auth_params = {
-            'client_id': config.MS_CLIENT_ID,
-            'response_type': 'code',
-            'redirect_uri': config.MS_REDIRECT_URI,
-            'scope': 'https://graph.microsoft.com/Mail.Read offline_access',
-            'state': state,
-            'response_mode': 'query'
-        }
-        
-        auth_url = "https://login.microsoftonline.com/common/oauth2/v2.0/authorize"
-        auth_url += "?" + "&".join(f"{key}={quote(str(value))}" for key, value in auth_params.items())
+        auth_url = token_manager.outlook_authorization_url(state)
         
         print(f"Redirecting to auth URL with state: {state}")  # Debug print
         return redirect(auth_url)
@@ -216,29 +254,14 @@ def outlook_callback():
         print(f"Code received: {code[:10]}...")
 
         # Exchange code for token
-        token_url = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
-        token_data = {
-            'client_id': config.MS_CLIENT_ID,
-            'client_secret': config.MS_CLIENT_SECRET,
-            'code': code,
-            'redirect_uri': config.MS_REDIRECT_URI,
-            'grant_type': 'authorization_code',
-            'scope': 'https://graph.microsoft.com/Mail.Read offline_access'
-        }
-
         print("Requesting token...")
-        response = requests.post(token_url, data=token_data)
-        
-        print(f"Token response status: {response.status_code}")
+        try:
+            session['outlook_token'] = token_manager.redeem_outlook_code(code)
+        except TokenError as e:
+            return f"Token error: {str(e)}"
         
-        if response.status_code == 200:
-            token_info = response.json()
-            print("Token received successfully")
-            session['outlook_token'] = token_info
-            session.modified = True
-            return redirect(url_for('dashboard'))
-        else:
-            return f"Token error: {response.text}"
+        print("Token received successfully")
+        return redirect(url_for('dashboard'))
 
     except Exception as e:
         import traceback
@@ -254,17 +277,7 @@ def authorize_outlook_simple():
     session.modified = True  # Mark the session as modified
     
     # Construct authorization URL
-    auth_params = {
-        'client_id': config.MS_CLIENT_ID,
-        'response_type': 'code',
-        'redirect_uri': config.MS_REDIRECT_URI,
-        'scope': 'https://graph.microsoft.com/Mail.Read offline_access',
-        'state': state,
-        'response_mode': 'query'
-    }
-    
-    auth_url = "https://login.microsoftonline.com/common/oauth2/v2.0/authorize"
-    auth_url += "?" + "&".join(f"{key}={quote(str(value))}" for key, value in auth_params.items())
+    auth_url = token_manager.outlook_authorization_url(state)
     
     # Print debug info
     print(f"Session before redirect: {session}")
@@ -287,60 +300,403 @@ def dashboard():
                          has_outlook=has_outlook,
                          has_whatsapp=has_whatsapp)
 
-def get_outlook_token():
-    """Get a valid Outlook token, refreshing if necessary"""
-    if 'outlook_token' not in session:
-        return None
-        
-    token = session['outlook_token']
+def snapshot_report_session(days_ago=30):
+    """Copy what a report needs out of the session, which background jobs can't reach"""
+    credentials = session.get('credentials')
+    outlook_token = session.get('outlook_token') or {}
+    whatsapp_phone = session.get('whatsapp_phone', '') if session.get('whatsapp_connected') else None
+    return {
+        'days_ago': days_ago,
+        'credentials': credentials,
+        'outlook_access_token': outlook_token.get('access_token'),
+        'outlook_home_account_id': outlook_token.get('home_account_id'),
+        'whatsapp_phone': whatsapp_phone,
+        # What identifies each connected account across token refreshes, None if not connected
+        'accounts': {
+            'gmail_report': (credentials.get('refresh_token') or credentials.get('token')) if credentials else None,
+            'outlook_report': (outlook_token.get('home_account_id') or outlook_token.get('refresh_token')
+                               or outlook_token.get('access_token')),
+            'whatsapp_report': whatsapp_phone
+        }
+    }
+
+def report_account_key(snapshot):
+    """Identify the accounts a report covers without keeping their tokens around"""
+    raw = json.dumps(snapshot['accounts'], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def build_gmail_report(snapshot):
+    credentials = token_manager.gmail_credentials(snapshot['credentials'])
+    gmail_system = EmailFollowUpSystem(
+        credentials,
+        page_size=config.GMAIL_PAGE_SIZE,
+        max_messages=config.GMAIL_MAX_MESSAGES,
+        state_store=sync_state_store if config.GMAIL_INCREMENTAL_SYNC else None,
+        scan_mode=config.GMAIL_SCAN_MODE,
+        classifier=classifier
+    )
+    return gmail_system.generate_follow_up_report(snapshot['days_ago'])
+
+def build_outlook_report(snapshot):
+    outlook_options = {'concurrency': config.OUTLOOK_CONCURRENCY} if config.OUTLOOK_ASYNC else {}
+    outlook_class = AsyncOutlookFollowUpSystem if config.OUTLOOK_ASYNC else OutlookFollowUpSystem
+    home_account_id = snapshot['outlook_home_account_id']
+    access_token = (token_manager.outlook_access_token(home_account_id) if home_account_id
+                    else snapshot['outlook_access_token'])
+    outlook_system = outlook_class(
+        access_token,
+        classifier=classifier,
+        identity_ttl=config.OUTLOOK_IDENTITY_TTL,
+        page_size=config.OUTLOOK_PAGE_SIZE,
+        max_messages=config.OUTLOOK_MAX_MESSAGES,
+        state_store=sync_state_store if config.OUTLOOK_DELTA_SYNC else None,
+        sync_max_age=config.OUTLOOK_SYNC_MAX_AGE,
+        conversation_engine=config.OUTLOOK_CONVERSATION_ENGINE,
+        **outlook_options
+    )
+    return outlook_system.generate_follow_up_report(snapshot['days_ago'])
+
+def build_whatsapp_report(snapshot):
+    whatsapp_system = WhatsAppFollowUpSystem(snapshot['whatsapp_phone'])
+    return whatsapp_system.generate_follow_up_report()
+
+# Report key, display name, builder and deadline of each provider
+REPORT_PROVIDERS = [
+    ('gmail_report', 'Gmail', build_gmail_report, config.GMAIL_REPORT_TIMEOUT),
+    ('outlook_report', 'Outlook', build_outlook_report, config.OUTLOOK_REPORT_TIMEOUT),
+    ('whatsapp_report', 'WhatsApp', build_whatsapp_report, config.WHATSAPP_REPORT_TIMEOUT),
+]
+# Values the JSON API accepts for its provider and bucket filters
+API_PROVIDERS = [key[:-len('_report')] for key, _, _, _ in REPORT_PROVIDERS]
+API_BUCKETS = ['explicit_follow_ups', 'unanswered_emails', 'unreplied_received', 'unanswered_chats']
+# Macro in report_sections.html that renders each provider's report
+REPORT_SECTION_MACROS = {
+    'gmail_report': 'gmail_section',
+    'outlook_report': 'outlook_section',
+    'whatsapp_report': 'whatsapp_section'
+}
+
+def connected_providers(snapshot):
+    """The providers a snapshot has accounts for, with each one's cache key"""
+    for key, name, build, timeout in REPORT_PROVIDERS:
+        account = snapshot['accounts'][key]
+        if account is not None:
+            yield key, name, build, timeout, report_cache.key(key, account, snapshot['days_ago'])
+
+def empty_report_result(snapshot):
+    result = {key: None for key, _, _, _ in REPORT_PROVIDERS}
+    result.update({'errors': [], 'provider_durations': {}, 'days_ago': snapshot['days_ago'], 'cache_age': None})
+    return result
+
+def timed_call(fn, *args):
+    """Call fn and return its result or exception along with how long it took"""
+    started = time.perf_counter()
+    try:
+        return fn(*args), None, time.perf_counter() - started
+    except Exception as e:
+        return None, e, time.perf_counter() - started
+
+def start_provider_reports(snapshot):
+    """Take fresh provider reports from the cache and start generating the others
     
-    # Check if token is expired
-    if token.get('expires_in', 0) < 300:  # Less than 5 minutes left
-        msal_app = ConfidentialClientApplication(
-            config.MS_CLIENT_ID,
-            authority=config.MS_AUTHORITY,
-            client_credential=config.MS_CLIENT_SECRET
-        )
-        
-        result = msal_app.acquire_token_silent(
-            config.MS_GRAPH_SCOPES,
-            account=None
-        )
+    Returns the cached reports by provider key, and the running builds mapped
+    to their provider's key, name, deadline and cache key.
+    """
+    cached = {}
+    futures = {}
+    for key, name, build, timeout, cache_key in connected_providers(snapshot):
+        entry = report_cache.get(cache_key)
+        if entry and report_cache.is_fresh(entry):
+            cached[key] = entry.report
+        else:
+            futures[provider_pool.submit(timed_call, build, snapshot)] = (key, name, timeout, cache_key)
+    return cached, futures
+
+def finished_provider_reports(futures, started):
+    """Yield (key, name, report, error, duration) for each started provider as soon as it finishes
+    
+    Successful reports are cached. A provider that fails comes with an error
+    message instead of a report, and one still running past its deadline also
+    comes without a duration.
+    """
+    pending = dict(futures)
+    while pending:
+        deadline = min(started + timeout for _, _, timeout, _ in pending.values())
+        done, _ = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            key, name, timeout, cache_key = pending.pop(future)
+            report, error, duration = future.result()
+            metrics.PROVIDER_REPORT_LATENCY.observe(duration, provider=key, outcome='error' if error else 'ok')
+            if error is not None:
+                print(f"Error generating {name} report: {str(error)}")
+                yield key, name, None, f"{name} report failed: {str(error)}", duration
+            else:
+                report_cache.put(cache_key, report)
+                yield key, name, report, None, duration
         
-        if result:
-            session['outlook_token'] = result
-            return result['access_token']
-            
-    return token.get('access_token')
+        now = time.monotonic()
+        for future, (key, name, timeout, cache_key) in list(pending.items()):
+            if not future.done() and now >= started + timeout:
+                # The call can't be interrupted, so it finishes in the background and is discarded
+                del pending[future]
+                metrics.PROVIDER_REPORT_LATENCY.observe(timeout, provider=key, outcome='timeout')
+                yield key, name, None, f"{name} took longer than {timeout:g} seconds and was skipped.", None
+
+def build_reports(job, snapshot):
+    """Generate every connected provider's report from a session snapshot, side by side
+    
+    Providers with a fresh cached report reuse it; the rest are generated and
+    cached. Each provider has its own deadline. Providers that fail or run
+    past it are left out of the result and reported in its errors list instead.
+    """
+    started = time.monotonic()
+    result = empty_report_result(snapshot)
+    cached, futures = start_provider_reports(snapshot)
+    result.update(cached)
+    remaining = [name for _, name, _, _ in futures.values()]
+    job.progress = f"Checking {', '.join(remaining)}" if remaining else 'Done'
+    
+    for key, name, report, error, duration in finished_provider_reports(futures, started):
+        result['provider_durations'][name] = round(duration, 2) if duration is not None else None
+        if error is not None:
+            result['errors'].append(error)
+        else:
+            result[key] = report
+        remaining.remove(name)
+        job.progress = f"Still checking {', '.join(remaining)}" if remaining else 'Done'
+    
+    logger.info("Report providers finished: %s", result['provider_durations'])
+    return result
+
+def provider_section(key, report):
+    """Render one provider's part of the report page"""
+    if not report:
+        return ''
+    return get_template_attribute('report_sections.html', REPORT_SECTION_MACROS[key])(report)
+
+def stream_report_sections(snapshot, provider_durations):
+    """Yield (key, html) for each connected provider's section as soon as it is ready
+    
+    Fills provider_durations as providers finish, for the end of the page.
+    """
+    started = time.monotonic()
+    cached, futures = start_provider_reports(snapshot)
+    for key, report in cached.items():
+        yield key, provider_section(key, report)
+    
+    errors_section = get_template_attribute('report_sections.html', 'errors_section')
+    for key, name, report, error, duration in finished_provider_reports(futures, started):
+        provider_durations[name] = round(duration, 2) if duration is not None else None
+        yield key, errors_section([error]) if error is not None else provider_section(key, report)
+
+def stream_report(snapshot):
+    """Send the report page at once and each provider's section as that provider finishes"""
+    provider_durations = {}
+    response = Response(stream_template(
+        'report_stream.html',
+        slots=[(key, name) for key, name, _, _, _ in connected_providers(snapshot)],
+        provider_sections=stream_report_sections(snapshot, provider_durations),
+        provider_durations=provider_durations,
+        days_ago=snapshot['days_ago']
+    ))
+    # Keep proxies from holding the page back until it is complete
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def refresh_cached_report(job, build, snapshot, cache_key):
+    """Regenerate one provider's stale cached report in the background"""
+    try:
+        report_cache.put(cache_key, build(snapshot))
+    except Exception:
+        report_cache.release_refresh(cache_key)
+        raise
+
+def cached_entries(snapshot):
+    """Get every connected provider's cached report entry, fresh or stale
+    
+    Stale entries are refreshed by a background job. Returns None if any
+    provider has nothing cached, or if no provider is connected.
+    """
+    entries = {}
+    for key, name, build, timeout, cache_key in connected_providers(snapshot):
+        entry = report_cache.get(cache_key)
+        if entry is None:
+            return None
+        entries[key] = entry
+        # The claim keeps other workers from refreshing the same entry at the same time
+        if not report_cache.is_fresh(entry) and report_cache.claim_refresh(cache_key):
+            report_jobs.submit(('refresh', cache_key), refresh_cached_report, build, snapshot, cache_key)
+    return entries or None
+
+def cached_reports(snapshot):
+    """Serve the report straight from the cache if every connected provider has an entry
+    
+    Stale entries are served too, while a background job refreshes them.
+    Returns None if any provider has nothing cached.
+    """
+    entries = cached_entries(snapshot)
+    return reports_from_entries(snapshot, entries) if entries is not None else None
+
+def reports_from_entries(snapshot, entries):
+    """Assemble a report result from cached provider entries"""
+    result = empty_report_result(snapshot)
+    result.update({key: entry.report for key, entry in entries.items()})
+    result['cache_age'] = int(time.time() - min(entry.created_at for entry in entries.values()))
+    return result
+
+def get_report_job(job_id):
+    """Look up a report job, but only for the accounts connected in this session"""
+    job = report_jobs.get(job_id)
+    if job is None or job.key[0] != report_account_key(snapshot_report_session()):
+        return None
+    return job
 
 @app.route('/generate-report')
 def generate_report():
-    gmail_report = None
-    outlook_report = None
-    whatsapp_report = None
+    days_ago = min(max(request.args.get('days_ago', 30, type=int), 1), config.MAX_REPORT_DAYS)
+    snapshot = snapshot_report_session(days_ago)
     
-    # Process Gmail data if connected
-    if 'credentials' in session:
-        credentials = credentials_from_dict(session['credentials'])
-        gmail_system = EmailFollowUpSystem(credentials)
-        gmail_report = gmail_system.generate_follow_up_report()
+    if request.args.get('refresh') == '1':
+        # Explicit refresh from the UI: forget the cached reports and start over
+        for key, name, build, timeout, cache_key in connected_providers(snapshot):
+            report_cache.invalidate(cache_key)
+    else:
+        cached = cached_reports(snapshot)
+        if cached is not None:
+            return render_template('report.html', **cached)
     
-    # Process Outlook data if connected
-    if 'outlook_token' in session:
-        access_token = session['outlook_token'].get('access_token')
-        outlook_system = OutlookFollowUpSystem(access_token)
-        outlook_report = outlook_system.generate_follow_up_report()
+    if config.REPORT_STREAMING:
+        return stream_report(snapshot)
     
-    # Process WhatsApp data if connected
-    if session.get('whatsapp_connected'):
-        phone = session.get('whatsapp_phone', '')
-        whatsapp_system = WhatsAppFollowUpSystem(phone)
-        whatsapp_report = whatsapp_system.generate_follow_up_report()
+    # Asking again while a report for the same accounts is running just follows that job
+    job = report_jobs.submit((report_account_key(snapshot), days_ago), build_reports, snapshot)
+    return render_template('loading.html', job_id=job.id)
+
+@app.route('/report-status/<job_id>')
+def report_status(job_id):
+    job = get_report_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Report not found'}), 404
+    status = job.to_dict()
+    status['result_url'] = url_for('report_result', job_id=job.id)
+    return jsonify(status)
+
+@app.route('/report/<job_id>')
+def report_result(job_id):
+    job = get_report_job(job_id)
+    if job is None:
+        # Expired or from another session, so start over
+        return redirect(url_for('generate_report'))
+    if not job.finished:
+        return render_template('loading.html', job_id=job.id)
+    if job.status == 'failed':
+        return render_template('report.html', errors=[f"Report generation failed: {job.error}"],
+                               days_ago=job.key[1])
+    return render_template('report.html', **job.result)
+
+def report_rows(result, providers, buckets, min_days_waiting):
+    """Flatten a report into one row per follow-up, tagged with its provider and list"""
+    rows = []
+    for key, _, _, _ in REPORT_PROVIDERS:
+        provider = key[:-len('_report')]
+        if not result.get(key) or provider not in providers:
+            continue
+        for bucket, items in result[key].items():
+            if bucket not in buckets or not isinstance(items, list):
+                continue
+            rows.extend(dict(item, provider=provider, bucket=bucket) for item in items
+                        if (item.get('days_waiting') or 0) >= min_days_waiting)
+    return rows
+
+def encode_cursor(offset, version):
+    """A cursor for the rows from offset on, valid only as long as the data is at version"""
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset, 'version': version}).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Offset and data version a cursor points at; raises ValueError for cursors we didn't hand out"""
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        offset, version = decoded['offset'], decoded['version']
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(offset, int) or offset < 0 or not isinstance(version, str):
+        raise ValueError("Invalid cursor")
+    return offset, version
+
+def api_list_arg(name, allowed):
+    """A comma separated query argument, defaulting to every allowed value"""
+    values = [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+    unknown = [value for value in values if value not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown {name}: {', '.join(unknown)}; expected one of {', '.join(allowed)}")
+    return values or list(allowed)
+
+@app.route('/api/report')
+def api_report():
+    """Follow-ups of the connected accounts as JSON rows, filtered and paginated
     
-    return render_template('report.html', 
-                         gmail_report=gmail_report,
-                         outlook_report=outlook_report,
-                         whatsapp_report=whatsapp_report)
+    Served from the report cache, or from the report job that is started when
+    nothing is cached yet (202 until it finishes). Responses carry an ETag
+    derived from the cached data and the query, so polling with If-None-Match
+    gets a 304 until something changes. Cursors are tied to the data they were
+    handed out for; once it is regenerated they get a 409 and the client starts
+    again from the first page.
+    """
+    days_ago = min(max(request.args.get('days_ago', 30, type=int), 1), config.MAX_REPORT_DAYS)
+    try:
+        providers = api_list_arg('provider', API_PROVIDERS)
+        buckets = api_list_arg('bucket', API_BUCKETS)
+        min_days_waiting = request.args.get('min_days_waiting', 0, type=int)
+        limit = min(max(request.args.get('limit', config.API_PAGE_SIZE, type=int), 1), config.API_MAX_PAGE_SIZE)
+        offset, cursor_version = decode_cursor(request.args['cursor']) if request.args.get('cursor') else (0, None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    
+    snapshot = snapshot_report_session(days_ago)
+    if not any(snapshot['accounts'].values()):
+        return jsonify({'error': 'No accounts connected'}), 401
+    
+    entries = cached_entries(snapshot)
+    if entries is not None:
+        result = reports_from_entries(snapshot, entries)
+        version = [entry.etag for entry in entries.values()]
+    else:
+        job_key = (report_account_key(snapshot), days_ago)
+        job = report_jobs.latest(job_key)
+        if job is None or job.status == 'failed':
+            job = report_jobs.submit(job_key, build_reports, snapshot)
+        if job.status != 'done':
+            status = job.to_dict()
+            status['status_url'] = url_for('report_status', job_id=job.id)
+            return jsonify(status), 202, {'Retry-After': '2'}
+        # A finished job's result never changes, so its ID versions it
+        result = job.result
+        version = [job.id]
+    
+    data_version = hashlib.sha256(json.dumps(version).encode()).hexdigest()[:16]
+    if cursor_version is not None and cursor_version != data_version:
+        # Offsets into the old rows would skip or repeat follow-ups in the new ones
+        return jsonify({'error': 'The report changed since this cursor was issued, start again without a cursor'}), 409
+    
+    query = [days_ago, providers, buckets, min_days_waiting, fields, limit, offset]
+    etag = hashlib.sha256(json.dumps([version, query]).encode()).hexdigest()[:32]
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache', 'Vary': 'Cookie'}
+    if request.if_none_match.contains(etag):
+        return '', 304, headers
+    
+    rows = report_rows(result, providers, buckets, min_days_waiting)
+    page = rows[offset:offset + limit]
+    if fields:
+        page = [{field: row[field] for field in fields if field in row} for row in page]
+    return jsonify({
+        'days_ago': days_ago,
+        'cache_age': result.get('cache_age'),
+        'errors': result.get('errors', []),
+        'total': len(rows),
+        'items': page,
+        'next_cursor': encode_cursor(offset + limit, data_version) if offset + limit < len(rows) else None
+    }), 200, headers
 
 @app.route('/logout')
 def logout():
@@ -350,6 +706,9 @@ def logout():
     
     # Clear Outlook token
     if 'outlook_token' in session:
+        home_account_id = session['outlook_token'].get('home_account_id')
+        if home_account_id:
+            token_manager.remove_outlook_account(home_account_id)
         del session['outlook_token']
     
     # Clear any other session data
@@ -433,23 +792,47 @@ def handle_error(e):
         <a href="/">Back to Home</a>
     """, 500
 
-# Add session debugging
 @app.before_request
-def log_request_info():
-    logger.debug('Headers: %s', dict(request.headers))
-    logger.debug('Body: %s', request.get_data())
-    logger.debug('Session: %s', {k: session.get(k) for k in session})
+def start_request_timer():
+    metrics.REGISTRY.start()
+    g.request_started = time.perf_counter()
+
+def observe_request(started, route, method, status):
+    """Observe a request's latency and log a sample of requests as structured JSON"""
+    duration = time.perf_counter() - started
+    metrics.REQUEST_LATENCY.observe(duration, route=route, method=method, status=status)
+    
+    # Errors and slow requests are always logged, everything else only in a sample
+    if access_logger.isEnabledFor(logging.INFO) and (
+            status >= 500 or duration >= config.LOG_SLOW_REQUEST_SECONDS
+            or random.random() < config.LOG_SAMPLE_RATE):
+        access_logger.info(json.dumps({
+            'route': route,
+            'method': method,
+            'status': status,
+            'duration_ms': round(duration * 1000, 1),
+            'sampled': status < 500 and duration < config.LOG_SLOW_REQUEST_SECONDS
+        }))
 
 @app.after_request
-def log_response_info(response):
-    logger.debug('Response Status: %s', response.status)
-    logger.debug('Response Headers: %s', dict(response.headers))
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    # The route pattern, not the raw path, so job IDs don't each get their own series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, response.status_code
+    if response.is_streamed:
+        # Streamed pages are still being sent at this point, so time them until the server closes them
+        response.call_on_close(lambda: observe_request(started, route, method, status))
+    else:
+        observe_request(started, route, method, status)
     return response
 
-@app.before_request
-def debug_session():
-    print(f"Current session: {session}")
-    print(f"Current route: {request.endpoint}")
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request and provider API metrics of this worker in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/authorize-whatsapp')
 def authorize_whatsapp():
@@ -0,0 +1,161 @@
+import asyncio
+from outlook_follow_up import (
+    OutlookFollowUpSystem, conversation_url, MAX_BATCH_SIZE, RESPONSE_ORDERBY, RESPONSE_SELECT,
+    REPLY_ORDERBY, REPLY_SELECT
+)
+from worker_local import PerProcess, start_daemon
+
+# Outlook allows 4 concurrent requests per app and mailbox; more only earns 429s
+DEFAULT_CONCURRENCY = 4
+
+
+class AsyncOutlookFollowUpSystem(OutlookFollowUpSystem):
+    """Outlook follow-up checks whose Graph calls run concurrently on asyncio
+
+    Requests still go through the pooled requests session, each on a worker
+    thread, with at most concurrency of them in flight per report. Listing
+    pages is pipelined with the conversation lookups of the pages already
+    listed, and the sent and received checks run side by side. Reports come
+    out the same as OutlookFollowUpSystem's.
+    """
+    def __init__(self, access_token, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        super().__init__(access_token, **kwargs)
+        self.concurrency = concurrency
+
+    async def _iter_pages_async(self, pages, semaphore):
+        """Pull pages from a synchronous page iterator without blocking the event loop
+        
+        A throttled page waits out its Retry-After inside the semaphore, so the
+        other requests in flight don't add to the throttling meanwhile.
+        """
+        while True:
+            async with semaphore:
+                page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                return
+            yield page
+
+    async def _batch_chunk_async(self, keys, urls, semaphore, results):
+        """Run one $batch of up to 20 lookups, retrying throttled ones after their Retry-After"""
+        pending = {key: urls[key] for key in keys}
+        attempt = 0
+
+        while pending:
+            retry = {}
+            chunk = {str(i): key for i, key in enumerate(pending)}
+            async with semaphore:
+                responses = await asyncio.to_thread(
+                    self._post_batch, {request_id: pending[key] for request_id, key in chunk.items()}
+                )
+            delay = self._collect_batch(chunk, responses, pending, attempt, results, retry)
+
+            pending = retry
+            if pending:
+                attempt += 1
+                # Only this batch waits; the others keep going
+                await asyncio.sleep(delay)
+
+    async def batch_get_async(self, urls, semaphore):
+        """GET many relative Graph URLs through $batch requests that run concurrently"""
+        results = {}
+        keys = list(urls)
+        await asyncio.gather(*(
+            self._batch_chunk_async(keys[start:start + MAX_BATCH_SIZE], urls, semaphore, results)
+            for start in range(0, len(keys), MAX_BATCH_SIZE)
+        ))
+        return results
+
+    async def get_conversations_async(self, conversation_ids, orderby, select, semaphore):
+        """Get the messages of many conversations with concurrent batched lookups"""
+        urls = {conversation_id: conversation_url(conversation_id, orderby, select)
+                for conversation_id in dict.fromkeys(conversation_ids)}
+        results = await self.batch_get_async(urls, semaphore)
+        return {conversation_id: body.get('value', []) for conversation_id, body in results.items()}
+
+    async def _lookup_pages_async(self, pages, select_emails, orderby, select, semaphore):
+        """List pages while looking up the conversations of the pages already listed
+
+        Returns the selected emails and their conversations.
+        """
+        emails = []
+        lookups = []
+        seen = set()
+        async for page in self._iter_pages_async(pages, semaphore):
+            page = select_emails(page)
+            new = [email['conversationId'] for email in page if email['conversationId'] not in seen]
+            seen.update(new)
+            if new:
+                lookups.append(asyncio.ensure_future(
+                    self.get_conversations_async(new, orderby, select, semaphore)
+                ))
+            emails.extend(page)
+
+        conversations = {}
+        for result in await asyncio.gather(*lookups):
+            conversations.update(result)
+        return emails, conversations
+
+    async def check_unanswered_sent_emails_async(self, days_ago, semaphore):
+        """Check for sent emails that haven't received responses, concurrently"""
+        sent_emails, conversations = await self._lookup_pages_async(
+            self.iter_sent_pages(days_ago), list, RESPONSE_ORDERBY, RESPONSE_SELECT, semaphore
+        )
+        addresses = self.identity.addresses
+        return [self._sent_entry(email) for email in sent_emails
+                if not self._has_response(conversations.get(email['conversationId'], []), addresses)]
+
+    async def check_unreplied_received_emails_async(self, days_ago, semaphore):
+        """Check for received emails that haven't been replied to, concurrently"""
+        def skip_automated(received_emails):
+            classifications = self.classifier.classify_batch(
+                {'subject': email['subject'], 'from': email['from']['emailAddress']['address']}
+                for email in received_emails
+            )
+            return [email for email, classification in zip(received_emails, classifications)
+                    if not classification.is_automated]
+
+        received_emails, conversations = await self._lookup_pages_async(
+            self.iter_received_pages(days_ago), skip_automated, REPLY_ORDERBY, REPLY_SELECT, semaphore
+        )
+        addresses = self.identity.addresses
+        return [self._received_entry(email) for email in received_emails
+                if not self._has_replied(conversations.get(email['conversationId'], []), addresses)]
+
+    async def generate_follow_up_report_async(self, days_ago=30):
+        """Generate the follow-up report with concurrent Graph calls"""
+        # Delta and bulk reports only make a handful of requests, so run them as they are
+        if self.state_store is not None or self.conversation_engine == 'bulk':
+            return await asyncio.to_thread(super().generate_follow_up_report, days_ago)
+
+        # Resolve the identity once, before the checks need it
+        await asyncio.to_thread(lambda: self.identity)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        unanswered_emails, unreplied_received = await asyncio.gather(
+            self.check_unanswered_sent_emails_async(days_ago, semaphore),
+            self.check_unreplied_received_emails_async(days_ago, semaphore)
+        )
+        return self._follow_up_report(unanswered_emails, unreplied_received)
+
+    def generate_follow_up_report(self, days_ago=30):
+        """Generate the follow-up report on the shared event loop and wait for it"""
+        return run_coroutine(self.generate_follow_up_report_async(days_ago))
+
+
+def _start_loop():
+    """Start an event loop on a daemon thread"""
+    loop = asyncio.new_event_loop()
+    start_daemon(loop.run_forever, 'outlook-event-loop')
+    return loop
+
+
+# The process's event loop, started on first use
+_loop = PerProcess(_start_loop)
+
+
+def run_coroutine(coroutine, timeout=None):
+    """Run a coroutine on the shared event loop from synchronous code, such as a Flask view
+
+    Only the calling thread waits, so other requests keep being served while
+    many reports share the one loop.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop.get()).result(timeout)
@@ -0,0 +1,85 @@
+"""Micro-benchmark for the follow-up classification engine.
+
+Classifies synthetic subject/sender pairs with the previous per-call rule
+checks and with ClassificationEngine.classify_batch, checks both agree, and
+prints the throughput of each.
+
+    python benchmarks/classification_bench.py [--messages 100000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classification import ClassificationEngine, Classification
+
+SUBJECT_WORDS = ['quarterly', 'plan', 'budget', 'meeting', 'notes', 'invoice', 'project', 'update',
+                 'lunch', 'contract', 'draft', 'review', 'launch', 'schedule', 'travel', 'report']
+SUBJECT_TRIGGERS = ['Question about', 'Request for', 'Please review', 'Follow up on', 'Newsletter:',
+                    'Promotion -', 'Big sale on', 'Special offer:', 'Any thoughts?']
+PREFIXES = ['', '', '', 'Re: ', 'RE: ', 'Fwd: ', 'FW: ']
+SENDERS = ['alice@example.com', 'Bob Smith <bob@example.org>', 'noreply@shop.example.com',
+           'no-reply@accounts.example.com', 'DoNotReply@bank.example.com', 'newsletter@news.example.com',
+           'Carol <carol.jones@example.net>']
+
+
+def make_messages(count, seed=1):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        words = ' '.join(rng.sample(SUBJECT_WORDS, 3))
+        trigger = rng.choice(SUBJECT_TRIGGERS) + ' ' if rng.random() < 0.4 else ''
+        messages.append({
+            'subject': f"{rng.choice(PREFIXES)}{trigger}{words}",
+            'from': rng.choice(SENDERS),
+        })
+    return messages
+
+
+def classify_legacy(messages):
+    """The previous approach: regex strings re-evaluated and keyword lists scanned per call"""
+    results = []
+    for message in messages:
+        subject = message['subject'].lower()
+        from_address = message['from'].lower()
+        is_reply = any(re.match(pattern, subject) for pattern in ['^re:', '^fwd:', '^fw:'])
+        is_automated = (any(keyword in subject for keyword in ['newsletter', 'promotion', 'sale', 'offer', 'no-reply'])
+                        or any(keyword in from_address for keyword in ['noreply', 'no-reply', 'donotreply', 'newsletter']))
+        needs_response = any(keyword in subject for keyword in ['question', 'request', 'follow up', 'please', '?'])
+        results.append(Classification(is_reply, is_automated, needs_response))
+    return results
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    engine, compile_time = timed(ClassificationEngine)
+
+    legacy, legacy_time = timed(classify_legacy, messages)
+    batched, batch_time = timed(engine.classify_batch, messages)
+
+    if legacy != batched:
+        mismatches = sum(1 for a, b in zip(legacy, batched) if a != b)
+        raise SystemExit(f"Engine disagrees with the legacy rules on {mismatches} messages")
+
+    print(f"{args.messages} subject/sender pairs (engine compiled in {compile_time * 1e3:.2f} ms)")
+    print(f"{'legacy per-call rules':26}{legacy_time:8.3f} s {args.messages / legacy_time:12,.0f} msg/s")
+    print(f"{'engine classify_batch':26}{batch_time:8.3f} s {args.messages / batch_time:12,.0f} msg/s")
+    print(f"speedup: {legacy_time / batch_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Compare format='full' with format='metadata' Gmail message fetches.
+
+Builds synthetic message resources shaped like Gmail API responses and reports
+the bytes each format puts on the wire plus the time to decode and extract the
+report fields per message.
+
+    python benchmarks/gmail_metadata_bench.py [--messages 2000] [--body-kb 24]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_follow_up import REPORT_METADATA_HEADERS, header_map
+
+# Typical transport headers that come back with format='full'
+TRANSPORT_HEADERS = [
+    ('Delivered-To', 'me@example.com'),
+    ('Received', 'by 2002:a05:6a10:1234 with SMTP id abc; Mon, 6 Oct 2025 09:00:00 -0700 (PDT)'),
+    ('X-Received', 'by 2002:a17:90a:1234 with SMTP id def; Mon, 6 Oct 2025 09:00:00 -0700 (PDT)'),
+    ('ARC-Seal', 'i=1; a=rsa-sha256; t=1696600000; cv=none; d=google.com; s=arc-20160816; b=' + 'x' * 340),
+    ('ARC-Message-Signature', 'i=1; a=rsa-sha256; c=relaxed/relaxed; d=google.com; b=' + 'y' * 340),
+    ('ARC-Authentication-Results', 'i=1; mx.google.com; dkim=pass header.i=@example.com'),
+    ('Return-Path', '<sender@example.com>'),
+    ('Received-SPF', 'pass (google.com: domain of sender@example.com designates 1.2.3.4)'),
+    ('Authentication-Results', 'mx.google.com; dkim=pass; spf=pass; dmarc=pass'),
+    ('DKIM-Signature', 'v=1; a=rsa-sha256; c=relaxed/relaxed; d=example.com; b=' + 'z' * 340),
+    ('MIME-Version', '1.0'),
+    ('Message-ID', '<CAF=abc123@mail.gmail.com>'),
+    ('Content-Type', 'multipart/alternative; boundary="000000000000abcdef"'),
+]
+
+
+def make_headers(i):
+    return [
+        ('From', f'Sender {i} <sender{i}@example.com>'),
+        ('Date', 'Mon, 6 Oct 2025 09:00:00 -0700'),
+        ('Subject', f'Question about the quarterly plan #{i}?'),
+        ('To', 'Me <me@example.com>'),
+    ]
+
+
+def make_full_message(i, body_kb):
+    text = base64.urlsafe_b64encode(os.urandom(body_kb * 512)).decode()
+    headers = TRANSPORT_HEADERS + make_headers(i)
+    return {
+        'id': f'msg{i}',
+        'threadId': f'thread{i}',
+        'labelIds': ['INBOX', 'UNREAD', 'CATEGORY_PERSONAL'],
+        'snippet': 'Hi, could you take a look at the attached plan before Friday',
+        'historyId': '123456',
+        'internalDate': '1696608000000',
+        'sizeEstimate': body_kb * 1024,
+        'payload': {
+            'partId': '',
+            'mimeType': 'multipart/alternative',
+            'filename': '',
+            'headers': [{'name': name, 'value': value} for name, value in headers],
+            'body': {'size': 0},
+            'parts': [
+                {'partId': '0', 'mimeType': 'text/plain', 'filename': '',
+                 'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+                 'body': {'size': len(text), 'data': text}},
+                {'partId': '1', 'mimeType': 'text/html', 'filename': '',
+                 'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="UTF-8"'}],
+                 'body': {'size': len(text), 'data': text}},
+            ],
+        },
+    }
+
+
+def make_metadata_message(i):
+    wanted = {name.lower() for name in REPORT_METADATA_HEADERS}
+    return {
+        'id': f'msg{i}',
+        'threadId': f'thread{i}',
+        'labelIds': ['INBOX', 'UNREAD', 'CATEGORY_PERSONAL'],
+        'snippet': 'Hi, could you take a look at the attached plan before Friday',
+        'historyId': '123456',
+        'internalDate': '1696608000000',
+        'sizeEstimate': 4096,
+        'payload': {
+            'mimeType': 'multipart/alternative',
+            'headers': [{'name': name, 'value': value} for name, value in make_headers(i)
+                        if name.lower() in wanted],
+        },
+    }
+
+
+def parse_with_scans(msg):
+    """The previous approach: one linear scan of the header list per field"""
+    headers = msg['payload']['headers']
+    return {
+        'subject': next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject'),
+        'to': next((h['value'] for h in headers if h['name'].lower() == 'to'), 'Unknown Recipient'),
+        'from': next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender'),
+        'date': next((h['value'] for h in headers if h['name'].lower() == 'date'), 'Unknown Date'),
+    }
+
+
+def parse_with_map(msg):
+    headers = header_map(msg['payload']['headers'])
+    return {
+        'subject': headers.get('subject', 'No Subject'),
+        'to': headers.get('to', 'Unknown Recipient'),
+        'from': headers.get('from', 'Unknown Sender'),
+        'date': headers.get('date', 'Unknown Date'),
+    }
+
+
+def measure(payloads, parse):
+    start = time.perf_counter()
+    for payload in payloads:
+        parse(json.loads(payload))
+    return (time.perf_counter() - start) / len(payloads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--body-kb', type=int, default=24)
+    args = parser.parse_args()
+
+    full = [json.dumps(make_full_message(i, args.body_kb)) for i in range(args.messages)]
+    metadata = [json.dumps(make_metadata_message(i)) for i in range(args.messages)]
+
+    full_bytes = sum(len(payload) for payload in full) / args.messages
+    metadata_bytes = sum(len(payload) for payload in metadata) / args.messages
+    full_time = measure(full, parse_with_scans)
+    metadata_time = measure(metadata, parse_with_map)
+
+    print(f"{args.messages} messages, ~{args.body_kb} KB bodies")
+    print(f"{'':28}{'bytes/msg':>12}{'parse us/msg':>15}")
+    print(f"{'full + header scans':28}{full_bytes:>12.0f}{full_time * 1e6:>15.1f}")
+    print(f"{'metadata + header map':28}{metadata_bytes:>12.0f}{metadata_time * 1e6:>15.1f}")
+    print(f"reduction: {full_bytes / metadata_bytes:.1f}x bytes, {full_time / metadata_time:.1f}x parse time")
+
+
+if __name__ == '__main__':
+    main()
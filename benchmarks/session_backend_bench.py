@@ -0,0 +1,113 @@
+"""Benchmark for the session backends.
+
+Runs the same request mix through the Flask test client with the previous
+Flask-Session filesystem backend and with the SQLite session store, checks
+both keep the same session data, and prints the requests per second of each.
+The mix is mostly requests that only read the session or don't use it at
+all, like report status polls and static assets, with an occasional write.
+
+    python benchmarks/session_backend_bench.py [--requests 5000] [--sessions 50]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, session
+
+from session_store import SQLiteSessionInterface, SQLiteSessionStore
+
+# A session shaped like a connected user's: Gmail credentials and an Outlook token
+CREDENTIALS = {
+    'token': 'ya29.' + 'a' * 160,
+    'refresh_token': '1//' + 'r' * 100,
+    'token_uri': 'https://oauth2.googleapis.com/token',
+    'client_id': '1234567890-abcdef.apps.googleusercontent.com',
+    'client_secret': 's' * 35,
+    'scopes': ['https://www.googleapis.com/auth/gmail.readonly']
+}
+OUTLOOK_TOKEN = {'access_token': 'eyJ0' + 't' * 1800, 'refresh_token': 'M.R3_' + 'r' * 900,
+                 'expires_in': 3599, 'token_type': 'Bearer'}
+# Relative share of read, write and session-free requests
+MIX = (('read', 70), ('static', 25), ('write', 5))
+
+
+def make_app(backend, directory):
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    app.config.update(SESSION_TYPE='filesystem', SESSION_FILE_DIR=os.path.join(directory, 'files'),
+                      SESSION_USE_SIGNER=True, PERMANENT_SESSION_LIFETIME=1800)
+    if backend == 'sqlite':
+        app.session_interface = SQLiteSessionInterface(SQLiteSessionStore(os.path.join(directory, 'sessions.db')))
+    else:
+        from flask_session import Session
+        Session(app)
+
+    @app.route('/login/<int:user>')
+    def login(user):
+        session['credentials'] = dict(CREDENTIALS, token=f"{CREDENTIALS['token']}{user}")
+        session['outlook_token'] = OUTLOOK_TOKEN
+        return 'ok'
+
+    @app.route('/read')
+    def read():
+        return session['credentials']['token'][-8:]
+
+    @app.route('/write')
+    def write():
+        session['counter'] = session.get('counter', 0) + 1
+        return str(session['counter'])
+
+    @app.route('/static')
+    def static_asset():
+        return 'body { color: black }'
+
+    return app
+
+
+def run(backend, requests, sessions, seed=1):
+    directory = tempfile.mkdtemp()
+    try:
+        app = make_app(backend, directory)
+        clients = [app.test_client() for _ in range(sessions)]
+        for user, client in enumerate(clients):
+            client.get(f'/login/{user}')
+
+        rng = random.Random(seed)
+        kinds = rng.choices([kind for kind, _ in MIX], [weight for _, weight in MIX], k=requests)
+        picks = [rng.randrange(sessions) for _ in range(requests)]
+        start = time.perf_counter()
+        for kind, pick in zip(kinds, picks):
+            clients[pick].get('/' + kind)
+        elapsed = time.perf_counter() - start
+
+        state = [(client.get('/read').data, client.get('/write').data) for client in clients]
+        return elapsed, state
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=50)
+    args = parser.parse_args()
+
+    filesystem_time, filesystem_state = run('filesystem', args.requests, args.sessions)
+    sqlite_time, sqlite_state = run('sqlite', args.requests, args.sessions)
+    if filesystem_state != sqlite_state:
+        raise SystemExit("The backends ended up with different session data")
+
+    print(f"{args.requests} requests over {args.sessions} sessions "
+          f"({', '.join(f'{weight}% {kind}' for kind, weight in MIX)})")
+    print(f"{'filesystem (flask_session)':28}{filesystem_time:8.3f} s {args.requests / filesystem_time:10,.0f} req/s")
+    print(f"{'sqlite session store':28}{sqlite_time:8.3f} s {args.requests / sqlite_time:10,.0f} req/s")
+
+
+if __name__ == '__main__':
+    main()
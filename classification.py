@@ -0,0 +1,107 @@
+from collections import namedtuple
+import json
+import re
+
+# Rules shared by the Gmail and Outlook reports; every keyword is matched as a lowercase substring
+DEFAULT_RULES = {
+    # Subject prefixes that mark a reply or forward of someone else's email
+    'reply_prefixes': ['re:', 'fwd:', 'fw:'],
+    # Subject keywords that suggest the recipient needs to respond
+    'needs_response_keywords': ['question', 'request', 'follow up', 'please', '?'],
+    # Subject and sender keywords of promotional or automated email
+    'automated_subject_keywords': ['newsletter', 'promotion', 'sale', 'offer', 'no-reply'],
+    'automated_sender_keywords': ['noreply', 'no-reply', 'donotreply', 'newsletter'],
+}
+
+Classification = namedtuple('Classification', ['is_reply', 'is_automated', 'needs_response'])
+
+# Bit flags for the subject rules a keyword triggers
+AUTOMATED = 1
+NEEDS_RESPONSE = 2
+
+
+def load_rules(path):
+    """Load rule overrides from a JSON file, falling back to the defaults for missing keys"""
+    with open(path, 'r') as f:
+        overrides = json.load(f)
+    unknown = set(overrides) - set(DEFAULT_RULES)
+    if unknown:
+        raise ValueError(f"Unknown classification rules: {', '.join(sorted(unknown))}")
+    return {**DEFAULT_RULES, **overrides}
+
+
+def _alternation(keywords):
+    # Longest first, so the matcher reports the longest keyword starting at each position
+    keywords = sorted({keyword.lower() for keyword in keywords}, key=len, reverse=True)
+    return '|'.join(re.escape(keyword) for keyword in keywords) or '(?!)'
+
+
+class ClassificationEngine:
+    """Compiles the follow-up rules once and classifies normalized messages in bulk
+
+    A normalized message is any mapping with 'subject' and 'from' keys. All
+    subject keywords are compiled into one zero-width pattern, so a single
+    findall reports every keyword at every position, overlapping ones
+    included. Each keyword maps to a bitmask of the rules it triggers, which
+    also covers any shorter keyword it contains.
+    """
+    def __init__(self, rules=None):
+        self.rules = {**DEFAULT_RULES, **(rules or {})}
+        self._reply_prefixes = tuple(prefix.lower() for prefix in self.rules['reply_prefixes'])
+        
+        flags = {}
+        for flag, rule in ((AUTOMATED, 'automated_subject_keywords'), (NEEDS_RESPONSE, 'needs_response_keywords')):
+            for keyword in self.rules[rule]:
+                flags[keyword.lower()] = flags.get(keyword.lower(), 0) | flag
+        
+        # A keyword implies the rules of every keyword it contains
+        self._subject_flags = {}
+        for keyword in flags:
+            combined = 0
+            for other, flag in flags.items():
+                if other in keyword:
+                    combined |= flag
+            self._subject_flags[keyword] = combined
+        
+        self._subject_matcher = re.compile(f"(?=({_alternation(flags)}))")
+        self._sender_matcher = re.compile(_alternation(self.rules['automated_sender_keywords']))
+
+    def classify(self, message):
+        """Classify one normalized message"""
+        return self.classify_batch([message])[0]
+
+    def classify_batch(self, messages):
+        """Classify a batch of normalized messages in one call, preserving order"""
+        find_keywords = self._subject_matcher.findall
+        search_sender = self._sender_matcher.search
+        subject_flags = self._subject_flags
+        reply_prefixes = self._reply_prefixes
+        results = []
+        
+        for message in messages:
+            subject = (message.get('subject') or '').lower()
+            flags = 0
+            for keyword in find_keywords(subject):
+                flags |= subject_flags[keyword]
+            
+            is_automated = bool(flags & AUTOMATED)
+            if not is_automated:
+                is_automated = search_sender((message.get('from') or '').lower()) is not None
+            results.append(Classification(
+                subject.startswith(reply_prefixes),
+                is_automated,
+                bool(flags & NEEDS_RESPONSE)
+            ))
+        
+        return results
+
+
+_default_engine = None
+
+
+def default_engine():
+    """Engine built from DEFAULT_RULES, compiled on first use"""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = ClassificationEngine()
+    return _default_engine
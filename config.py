@@ -23,6 +23,20 @@ CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', client_config.get('client
 REDIRECT_URI = os.environ.get('REDIRECT_URI', 'http://localhost:5000/oauth2callback')
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Gmail listing limits (page size is capped at 500 by the API)
+GMAIL_PAGE_SIZE = int(os.environ.get('GMAIL_PAGE_SIZE', 100))
+GMAIL_MAX_MESSAGES = int(os.environ.get('GMAIL_MAX_MESSAGES', 2000))
+# 'threads' evaluates each conversation once, 'messages' reports every matching message
+GMAIL_SCAN_MODE = os.environ.get('GMAIL_SCAN_MODE', 'threads')
+# Keep Gmail reports up to date through the history API instead of rescanning
+GMAIL_INCREMENTAL_SYNC = os.environ.get('GMAIL_INCREMENTAL_SYNC', 'true').lower() == 'true'
+
+# Optional JSON file overriding the follow-up classification rules
+CLASSIFICATION_RULES_FILE = os.environ.get('CLASSIFICATION_RULES_FILE')
+
+# Local directory for incremental sync state
+SYNC_STATE_DIR = os.environ.get('SYNC_STATE_DIR', '.recap_state')
+
 # Microsoft OAuth Configuration
 MS_CLIENT_ID = os.environ.get('MS_CLIENT_ID')
 MS_CLIENT_SECRET = os.environ.get('MS_CLIENT_SECRET')
@@ -30,6 +44,79 @@ MS_REDIRECT_URI = os.environ.get('MS_REDIRECT_URI', 'http://localhost:8000/outlo
 MS_AUTHORITY = 'https://login.microsoftonline.com/common'
 MS_GRAPH_SCOPES = ['https://graph.microsoft.com/Mail.Read']
 
+# Pooled Microsoft Graph connections (timeouts in seconds)
+GRAPH_POOL_SIZE = int(os.environ.get('GRAPH_POOL_SIZE', 10))
+GRAPH_CONNECT_TIMEOUT = float(os.environ.get('GRAPH_CONNECT_TIMEOUT', 5))
+GRAPH_READ_TIMEOUT = float(os.environ.get('GRAPH_READ_TIMEOUT', 30))
+# Outlook listing limits (page size is a hint to Graph, which may return smaller pages)
+OUTLOOK_PAGE_SIZE = int(os.environ.get('OUTLOOK_PAGE_SIZE', 50))
+OUTLOOK_MAX_MESSAGES = int(os.environ.get('OUTLOOK_MAX_MESSAGES', 2000))
+# Seconds a resolved Outlook user identity is cached per access token
+OUTLOOK_IDENTITY_TTL = int(os.environ.get('OUTLOOK_IDENTITY_TTL', 3600))
+# How Outlook reports decide if conversations were answered: 'lookup' queries each
+# conversation, 'bulk' groups every message in the window (fewer requests, but blind
+# to messages from before the window)
+OUTLOOK_CONVERSATION_ENGINE = os.environ.get('OUTLOOK_CONVERSATION_ENGINE', 'lookup')
+# Run Outlook conversation checks concurrently on asyncio, with at most this many Graph
+# requests in flight per report (Outlook allows 4 per app and mailbox)
+OUTLOOK_ASYNC = os.environ.get('OUTLOOK_ASYNC', 'false').lower() == 'true'
+OUTLOOK_CONCURRENCY = int(os.environ.get('OUTLOOK_CONCURRENCY', 4))
+# Keep Outlook reports up to date with Graph delta queries instead of rescanning,
+# starting over with a full sync once the saved state is older than the max age (seconds)
+OUTLOOK_DELTA_SYNC = os.environ.get('OUTLOOK_DELTA_SYNC', 'true').lower() == 'true'
+OUTLOOK_SYNC_MAX_AGE = int(os.environ.get('OUTLOOK_SYNC_MAX_AGE', 7 * 24 * 3600))
+
+# Background report jobs: worker threads, and seconds a finished report stays available
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 4))
+REPORT_JOB_TTL = int(os.environ.get('REPORT_JOB_TTL', 600))
+# Longest report window users can ask for, in days
+MAX_REPORT_DAYS = int(os.environ.get('MAX_REPORT_DAYS', 365))
+
+# Report cache shared by all workers: seconds a report is fresh, seconds a stale one may
+# still be served while it refreshes, and how many provider reports to keep
+REPORT_CACHE_PATH = os.environ.get('REPORT_CACHE_PATH', os.path.join(SYNC_STATE_DIR, 'report_cache.sqlite3'))
+REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 300))
+REPORT_CACHE_MAX_STALE = int(os.environ.get('REPORT_CACHE_MAX_STALE', 24 * 3600))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 500))
+
+# Stream the report page instead of generating it in a background job: the page is sent at
+# once and each provider's section follows as it finishes, while the request worker waits
+REPORT_STREAMING = os.environ.get('REPORT_STREAMING', 'false').lower() == 'true'
+
+# Rows per page of the JSON report API, by default and at most
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 500))
+
+# Seconds each provider gets to build its part of a report before it is skipped
+GMAIL_REPORT_TIMEOUT = float(os.environ.get('GMAIL_REPORT_TIMEOUT', 120))
+OUTLOOK_REPORT_TIMEOUT = float(os.environ.get('OUTLOOK_REPORT_TIMEOUT', 120))
+WHATSAPP_REPORT_TIMEOUT = float(os.environ.get('WHATSAPP_REPORT_TIMEOUT', 30))
+
+# Where sessions live: 'sqlite' for a database shared by every worker process, or
+# 'filesystem' for Flask-Session's pickle files; expired sessions are deleted every
+# SESSION_CLEANUP_INTERVAL seconds
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', os.path.join(SYNC_STATE_DIR, 'sessions.sqlite3'))
+SESSION_CLEANUP_INTERVAL = int(os.environ.get('SESSION_CLEANUP_INTERVAL', 300))
+
+# Outlook token cache shared by every worker, and when tokens are refreshed: seconds before
+# they expire, seconds between checks, and seconds an account may go unused before it is dropped
+TOKEN_CACHE_PATH = os.environ.get('TOKEN_CACHE_PATH', os.path.join(SYNC_STATE_DIR, 'msal_token_cache.json'))
+TOKEN_REFRESH_MARGIN = int(os.environ.get('TOKEN_REFRESH_MARGIN', 600))
+TOKEN_REFRESH_INTERVAL = int(os.environ.get('TOKEN_REFRESH_INTERVAL', 60))
+TOKEN_IDLE_TTL = int(os.environ.get('TOKEN_IDLE_TTL', 3600))
+
+# Logging: level for every logger, the fraction of ordinary requests written to the access
+# log, and seconds after which a request counts as slow (errors and slow requests are always logged)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+LOG_SLOW_REQUEST_SECONDS = float(os.environ.get('LOG_SLOW_REQUEST_SECONDS', 2))
+
+# Metrics: every worker writes its values to this directory every few seconds so /metrics
+# can add them up; clear it when deploying, or counters carry on from the last deployment
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(SYNC_STATE_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
 # Flask Configuration
 SECRET_KEY = os.environ.get('SECRET_KEY', os.urandom(24).hex())
 FLASK_SECRET_KEY = os.environ.get('FLASK_SECRET_KEY', os.urandom(24).hex())
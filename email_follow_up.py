@@ -1,48 +1,232 @@
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from datetime import datetime, timedelta
 import email.utils
+import hashlib
+import logging
+import threading
 import pytz
-import re
+from classification import default_engine
+from gmail_scheduler import get_scheduler
+from sync_state import account_key
+
+logger = logging.getLogger(__name__)
+
+# messages.list returns at most 500 IDs per page
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_MESSAGES = 2000
+# Reply checks only need to know who sent each message in a thread
+THREAD_METADATA_HEADERS = ['From']
+# Every header the report shows, requested instead of full message payloads
+REPORT_METADATA_HEADERS = ['Subject', 'To', 'From', 'Date']
+SYNC_STATE_VERSION = 1
+
+
+def header_map(headers):
+    """Index message headers by lowercase name, keeping the first value of repeated headers"""
+    return {header['name'].lower(): header['value'] for header in reversed(headers)}
+
+
+class AccountIdentity:
+    """The addresses a Gmail user sends from, including send-as aliases"""
+    def __init__(self, email_address, aliases=()):
+        self.email_address = email_address
+        self.addresses = frozenset(address.lower() for address in (email_address, *aliases))
+
+    def is_user_address(self, header):
+        """Check if any address in a From header belongs to the user"""
+        return any(address.lower() in self.addresses
+                   for _, address in email.utils.getaddresses([header]))
+
+
+# Identities never change for a set of credentials, so resolve them once per process
+_identity_cache = {}
+_identity_lock = threading.Lock()
+
+
+def credentials_key(credentials):
+    """Stable, non-reversible cache key for a set of credentials"""
+    raw = f"{credentials.client_id}:{credentials.refresh_token or credentials.token}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_account_identity(service, credentials, scheduler):
+    """Get the user's address and send-as aliases, calling the API only on first use"""
+    key = credentials_key(credentials)
+    with _identity_lock:
+        identity = _identity_cache.get(key)
+    if identity:
+        return identity
+    
+    profile = scheduler.execute(service.users().getProfile(userId='me'))
+    aliases = []
+    try:
+        send_as = scheduler.execute(service.users().settings().sendAs().list(userId='me'))
+        aliases = [alias['sendAsEmail'] for alias in send_as.get('sendAs', [])]
+    except HttpError as e:
+        print(f"Error getting send-as aliases: {str(e)}")
+    
+    identity = AccountIdentity(profile['emailAddress'], aliases)
+    with _identity_lock:
+        _identity_cache[key] = identity
+    return identity
+
+
+class ThreadStore:
+    """Per-report cache that downloads each Gmail thread once, as lightweight metadata"""
+    def __init__(self, service, scheduler, metadata_headers=THREAD_METADATA_HEADERS):
+        self.service = service
+        self.scheduler = scheduler
+        self.metadata_headers = metadata_headers
+        self.threads = {}
+        self.hits = 0
+        self.misses = 0
+        self._requested = set()
+
+    def _request(self, thread_id):
+        return self.service.users().threads().get(
+            userId='me', id=thread_id, format='metadata', metadataHeaders=self.metadata_headers
+        )
+
+    def prefetch(self, thread_ids):
+        """Load every thread that isn't cached yet using batched requests"""
+        missing = [thread_id for thread_id in dict.fromkeys(thread_ids) if thread_id not in self.threads]
+        self.threads.update(self.scheduler.execute_batch(self.service, missing, self._request))
+
+    def get(self, thread_id):
+        """Return a thread, fetching it only the first time it's needed"""
+        if thread_id in self._requested:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._requested.add(thread_id)
+        
+        if thread_id not in self.threads:
+            self.threads[thread_id] = self.scheduler.execute(self._request(thread_id))
+        return self.threads[thread_id]
+
+    def stats(self):
+        """Return hit/miss counts so the savings are visible"""
+        return {'hits': self.hits, 'misses': self.misses, 'threads': len(self.threads)}
+
 
 class EmailFollowUpSystem:
-    def __init__(self, credentials):
+    def __init__(self, credentials, page_size=DEFAULT_PAGE_SIZE, max_messages=DEFAULT_MAX_MESSAGES,
+                 state_store=None, scan_mode='messages', classifier=None):
+        self.credentials = credentials
+        self.classifier = classifier or default_engine()
+        self.page_size = page_size
+        self.max_messages = max_messages
+        # 'messages' reports every matching message, 'threads' evaluates each conversation once
+        self.scan_mode = scan_mode
+        # When set, reports are kept up to date incrementally through the history API
+        self.state_store = state_store
         self.service = build('gmail', 'v1', credentials=credentials)
+        # Every Gmail call goes through the account's shared, quota-aware scheduler
+        self.scheduler = get_scheduler(credentials_key(credentials))
+        self.thread_store = ThreadStore(self.service, self.scheduler)
+        self._identity = None
+
+    @property
+    def identity(self):
+        """The user's addresses, resolved once and shared across the session"""
+        if self._identity is None:
+            self._identity = get_account_identity(self.service, self.credentials, self.scheduler)
+        return self._identity
+        
+    def window_start(self, days_ago=30):
+        """Start of the report window, matching the day granularity of Gmail's after: search"""
+        return (datetime.now() - timedelta(days=days_ago)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def folder_query(self, folder, days_ago=30):
+        """Search query for a folder over the last days_ago days"""
+        return f"in:{folder} after:{self.window_start(days_ago).strftime('%Y/%m/%d')}"
+
+    def _iter_list_pages(self, resource, result_key, query):
+        """Yield pages of a list call, following nextPageToken lazily up to max_messages items"""
+        remaining = self.max_messages
+        page_token = None
+        
+        while remaining is None or remaining > 0:
+            page_size = self.page_size if remaining is None else min(self.page_size, remaining)
+            results = self.scheduler.execute(resource.list(
+                userId='me', q=query, maxResults=page_size, pageToken=page_token
+            ))
+            
+            items = results.get(result_key, [])
+            if remaining is not None:
+                items = items[:remaining]
+                remaining -= len(items)
+            if items:
+                yield items
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
         
+        print(f"Stopped listing {result_key} for '{query}' after {self.max_messages} items")
+
+    def iter_message_pages(self, query):
+        """Yield pages of message stubs, following nextPageToken lazily up to max_messages"""
+        return self._iter_list_pages(self.service.users().messages(), 'messages', query)
+
+    def iter_thread_pages(self, query):
+        """Yield pages of thread stubs, following nextPageToken lazily up to max_messages"""
+        return self._iter_list_pages(self.service.users().threads(), 'threads', query)
+
+    def iter_messages(self, query):
+        """Yield message stubs one at a time across all pages"""
+        for page in self.iter_message_pages(query):
+            yield from page
+
+    def iter_email_detail_pages(self, folder, days_ago=30):
+        """Yield the details of each page of a folder as soon as the page is listed"""
+        for page in self.iter_message_pages(self.folder_query(folder, days_ago)):
+            yield self.get_email_details_batch(message['id'] for message in page)
+
     def get_sent_emails(self, days_ago=30):
         """Get sent emails from the last 30 days"""
-        query = f"in:sent after:{(datetime.now() - timedelta(days=days_ago)).strftime('%Y/%m/%d')}"
-        results = self.service.users().messages().list(userId='me', q=query).execute()
-        return results.get('messages', [])
+        return list(self.iter_messages(self.folder_query('sent', days_ago)))
 
     def get_received_emails(self, days_ago=30):
         """Get received emails from the last 30 days"""
-        query = f"in:inbox after:{(datetime.now() - timedelta(days=days_ago)).strftime('%Y/%m/%d')}"
-        results = self.service.users().messages().list(userId='me', q=query).execute()
-        return results.get('messages', [])
+        return list(self.iter_messages(self.folder_query('inbox', days_ago)))
+
+    def _details_request(self, msg_id):
+        # Only the report headers are needed, so skip bodies and attachment metadata
+        return self.service.users().messages().get(
+            userId='me', id=msg_id, format='metadata', metadataHeaders=REPORT_METADATA_HEADERS
+        )
 
     def get_email_details(self, msg_id):
         """Get detailed information about an email"""
-        msg = self.service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        headers = msg['payload']['headers']
-        
-        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-        to = next((h['value'] for h in headers if h['name'].lower() == 'to'), 'Unknown Recipient')
-        from_header = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
-        date = next((h['value'] for h in headers if h['name'].lower() == 'date'), 'Unknown Date')
+        msg = self.scheduler.execute(self._details_request(msg_id))
+        return self._parse_email_details(msg)
+
+    def get_email_details_batch(self, msg_ids):
+        """Get detailed information about many emails using batched requests"""
+        msg_ids = list(dict.fromkeys(msg_ids))
+        messages = self.scheduler.execute_batch(self.service, msg_ids, self._details_request)
+        return [self._parse_email_details(messages[msg_id]) for msg_id in msg_ids if msg_id in messages]
+
+    def _parse_email_details(self, msg):
+        """Extract the report fields from a Gmail message resource"""
+        headers = header_map(msg['payload']['headers'])
         
         return {
-            'id': msg_id,
-            'subject': subject,
-            'to': to,
-            'from': from_header,
-            'date': date,
-            'thread_id': msg['threadId']
+            'id': msg['id'],
+            'subject': headers.get('subject', 'No Subject'),
+            'to': headers.get('to', 'Unknown Recipient'),
+            'from': headers.get('from', 'Unknown Sender'),
+            'date': headers.get('date', 'Unknown Date'),
+            'thread_id': msg['threadId'],
+            'internal_date': int(msg.get('internalDate', 0))
         }
 
     def check_for_response(self, thread_id):
         """Check if there's been a response in the thread"""
-        thread = self.service.users().threads().get(userId='me', id=thread_id).execute()
+        thread = self.thread_store.get(thread_id)
         messages = thread['messages']
         
         # If there's only one message in the thread, no response received
@@ -51,167 +235,329 @@ class EmailFollowUpSystem:
             
         # Check if the last message in the thread was from someone else
         last_msg = messages[-1]
-        headers = last_msg['payload']['headers']
-        from_header = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
-        
-        # Get user's email
-        profile = self.service.users().getProfile(userId='me').execute()
-        user_email = profile['emailAddress']
+        from_header = header_map(last_msg['payload']['headers']).get('from', '')
         
         # If the last message is from the user, no response received
-        return not from_header.lower().find(user_email.lower()) >= 0
+        return not self.identity.is_user_address(from_header)
 
     def is_reply_email(self, subject):
         """Check if the email is a reply (starts with Re: or similar)"""
-        reply_patterns = ['^re:', '^fwd:', '^fw:']
-        return any(re.match(pattern, subject.lower()) for pattern in reply_patterns)
+        return self.classifier.classify({'subject': subject}).is_reply
+
+    def requires_response(self, subject):
+        """Check if the subject suggests the recipient needs to respond"""
+        return self.classifier.classify({'subject': subject}).needs_response
+
+    def is_automated_email(self, details):
+        """Check if a received email looks promotional or automated"""
+        return self.classifier.classify(details).is_automated
+
+    def get_days_waiting(self, date):
+        """Number of days since the given Date header"""
+        try:
+            parsed_date = email.utils.parsedate_to_datetime(date)
+            return (datetime.now(pytz.UTC) - parsed_date).days
+        except:
+            return 0  # Default if date parsing fails
+
+    def _sent_entry(self, details):
+        return {
+            'subject': details['subject'],
+            'to': details['to'],
+            'date': details['date'],
+            'days_waiting': self.get_days_waiting(details['date'])
+        }
+
+    def _received_entry(self, details):
+        return {
+            'subject': details['subject'],
+            'from': details.get('from', 'Unknown Sender'),
+            'date': details['date'],
+            'days_waiting': self.get_days_waiting(details['date'])
+        }
+
+    def classify_sent_email(self, details, classification=None):
+        """Return the report buckets a sent email belongs to"""
+        classification = classification or self.classifier.classify(details)
+        buckets = []
+        
+        if ((classification.needs_response or not classification.is_reply)
+                and not self.check_for_response(details['thread_id'])):
+            if classification.needs_response:
+                buckets.append('explicit_follow_ups')
+            # Replies to someone else's email aren't waiting on an answer
+            if not classification.is_reply:
+                buckets.append('unanswered_emails')
+        return buckets
+
+    def classify_received_email(self, details, classification=None):
+        """Return the report buckets a received email belongs to"""
+        classification = classification or self.classifier.classify(details)
+        # Skip if likely automated/promotional
+        if classification.is_automated:
+            return []
+        if not self.check_if_replied(details['thread_id']):
+            return ['unreplied_received']
+        return []
 
     def check_unanswered_sent_emails(self, days_ago=30):
         """Check for all sent emails that haven't received responses"""
-        query = f"in:sent after:{(datetime.now() - timedelta(days=days_ago)).strftime('%Y/%m/%d')}"
-        results = self.service.users().messages().list(userId='me', q=query).execute()
-        messages = results.get('messages', [])
-        
         unanswered_emails = []
         
-        for message in messages:
-            details = self.get_email_details(message['id'])
-            
-            # Skip if it's a reply to someone else's email
-            if self.is_reply_email(details['subject']):
-                continue
-                
-            # Check if there's been a response
-            has_response = self.check_for_response(details['thread_id'])
-            
-            if not has_response:
-                # Parse the email date properly
-                try:
-                    parsed_date = email.utils.parsedate_to_datetime(details['date'])
-                    days_waiting = (datetime.now(pytz.UTC) - parsed_date).days
-                except:
-                    days_waiting = 0  # Default if date parsing fails
-                
-                unanswered_emails.append({
-                    'subject': details['subject'],
-                    'to': details['to'],
-                    'date': details['date'],
-                    'days_waiting': days_waiting
-                })
+        for sent_details in self.iter_email_detail_pages('sent', days_ago):
+            candidates = [details for details in sent_details if not self.is_reply_email(details['subject'])]
+            self.thread_store.prefetch(details['thread_id'] for details in candidates)
+            unanswered_emails.extend(self._sent_entry(details) for details in candidates
+                                     if not self.check_for_response(details['thread_id']))
         
         return unanswered_emails
 
     def check_unreplied_received_emails(self, days_ago=30):
         """Check for received emails that haven't been replied to"""
-        received_emails = self.get_received_emails(days_ago)
         unreplied_emails = []
         
-        for email in received_emails:
-            details = self.get_email_details(email['id'])
-            
-            # Skip if it's a promotional or automated email
-            subject = details['subject'].lower()
-            from_address = details.get('from', '').lower()
-            
-            # Skip if likely automated/promotional
-            if any(keyword in subject for keyword in ['newsletter', 'promotion', 'sale', 'offer', 'no-reply']):
-                continue
-                
-            if any(keyword in from_address for keyword in ['noreply', 'no-reply', 'donotreply', 'newsletter']):
-                continue
-            
-            # Check if you've replied
-            has_replied = self.check_if_replied(details['thread_id'])
-            
-            if not has_replied:
-                # Parse the email date properly
-                try:
-                    parsed_date = email.utils.parsedate_to_datetime(details['date'])
-                    days_waiting = (datetime.now(pytz.UTC) - parsed_date).days
-                except:
-                    days_waiting = 0
-                
-                unreplied_emails.append({
-                    'subject': details['subject'],
-                    'from': details.get('from', 'Unknown Sender'),
-                    'date': details['date'],
-                    'days_waiting': days_waiting
-                })
+        for received_details in self.iter_email_detail_pages('inbox', days_ago):
+            candidates = [details for details in received_details if not self.is_automated_email(details)]
+            self.thread_store.prefetch(details['thread_id'] for details in candidates)
+            unreplied_emails.extend(self._received_entry(details) for details in candidates
+                                    if not self.check_if_replied(details['thread_id']))
         
         return unreplied_emails
     
     def check_if_replied(self, thread_id):
         """Check if the user has replied to this thread"""
-        thread = self.service.users().threads().get(userId='me', id=thread_id).execute()
+        thread = self.thread_store.get(thread_id)
         messages = thread['messages']
         
         if len(messages) <= 1:
             # Only one message in thread, so no reply
             return False
         
-        # Get user's email
-        profile = self.service.users().getProfile(userId='me').execute()
-        user_email = profile['emailAddress']
-        
         # Check if any messages after the first one are from the user
         for i in range(1, len(messages)):
-            msg = messages[i]
-            headers = msg['payload']['headers']
-            from_header = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
+            from_header = header_map(messages[i]['payload']['headers']).get('from', '')
             
-            if user_email.lower() in from_header.lower():
+            if self.identity.is_user_address(from_header):
                 return True
                 
         return False
 
-    def identify_follow_ups_needed(self):
+    def identify_follow_ups_needed(self, days_ago=30):
         """Main function to identify emails needing follow-up"""
-        sent_emails = self.get_sent_emails()
         follow_ups_needed = []
         
-        for email in sent_emails:
-            details = self.get_email_details(email['id'])
+        for sent_details in self.iter_email_detail_pages('sent', days_ago):
+            candidates = [details for details in sent_details if self.requires_response(details['subject'])]
+            self.thread_store.prefetch(details['thread_id'] for details in candidates)
+            follow_ups_needed.extend(self._sent_entry(details) for details in candidates
+                                     if not self.check_for_response(details['thread_id']))
+        
+        return follow_ups_needed
+
+    def scan_mailbox(self, days_ago=30):
+        """Classify every message in the window, grouped by thread ID"""
+        # Share one thread store across the whole scan
+        self.thread_store = ThreadStore(self.service, self.scheduler)
+        thread_records = {}
+        
+        # List each folder once, processing every page as soon as it arrives
+        for sent_details in self.iter_email_detail_pages('sent', days_ago):
+            # Only threads that can change the outcome are worth downloading
+            candidates = [(details, classification) for details, classification
+                          in zip(sent_details, self.classifier.classify_batch(sent_details))
+                          if classification.needs_response or not classification.is_reply]
+            self.thread_store.prefetch(details['thread_id'] for details, _ in candidates)
             
-            # Check if this email seems to require a response
-            subject = details['subject'].lower()
-            requires_response = any(keyword in subject for keyword in 
-                ['question', 'request', 'follow up', 'please', '?'])
+            for details, classification in candidates:
+                for bucket in self.classify_sent_email(details, classification):
+                    thread_records.setdefault(details['thread_id'], []).append({'bucket': bucket, 'details': details})
+        
+        for received_details in self.iter_email_detail_pages('inbox', days_ago):
+            candidates = [(details, classification) for details, classification
+                          in zip(received_details, self.classifier.classify_batch(received_details))
+                          if not classification.is_automated]
+            self.thread_store.prefetch(details['thread_id'] for details, _ in candidates)
             
-            if requires_response:
-                has_response = self.check_for_response(details['thread_id'])
-                if not has_response:
-                    # Parse the email date properly
-                    try:
-                        parsed_date = email.utils.parsedate_to_datetime(details['date'])
-                        days_waiting = (datetime.now(pytz.UTC) - parsed_date).days
-                    except:
-                        days_waiting = 0  # Default if date parsing fails
-                    
-                    follow_ups_needed.append({
-                        'subject': details['subject'],
-                        'to': details['to'],
-                        'date': details['date'],
-                        'days_waiting': days_waiting
-                    })
+            for details, classification in candidates:
+                for bucket in self.classify_received_email(details, classification):
+                    thread_records.setdefault(details['thread_id'], []).append({'bucket': bucket, 'details': details})
         
-        return follow_ups_needed
+        stats = self.thread_store.stats()
+        logger.debug("Thread store: %d hits, %d misses, %d threads fetched",
+                     stats['hits'], stats['misses'], stats['threads'])
+        
+        return thread_records
 
-    def generate_follow_up_report(self):
-        """Generate a comprehensive report of emails needing follow-up"""
-        # Get emails that explicitly need responses (based on keywords)
-        explicit_follow_ups = self.identify_follow_ups_needed()
-        # Get all unanswered sent emails
-        unanswered_emails = self.check_unanswered_sent_emails()
-        # Get all unreplied received emails
-        unreplied_received = self.check_unreplied_received_emails()
+    def scan_threads(self, days_ago=30):
+        """Classify each conversation in the window exactly once, grouped by thread ID"""
+        self.thread_store = ThreadStore(self.service, self.scheduler, REPORT_METADATA_HEADERS)
+        thread_records = {}
+        seen = set()
         
-        # Sort by days waiting
-        explicit_follow_ups.sort(key=lambda x: x.get('days_waiting', 0), reverse=True)
-        unanswered_emails.sort(key=lambda x: x.get('days_waiting', 0), reverse=True)
-        unreplied_received.sort(key=lambda x: x.get('days_waiting', 0), reverse=True)
+        for folder in ('sent', 'inbox'):
+            for page in self.iter_thread_pages(self.folder_query(folder, days_ago)):
+                # Threads matching both folders are only evaluated the first time
+                thread_ids = [thread['id'] for thread in page if thread['id'] not in seen]
+                seen.update(thread_ids)
+                self.thread_store.prefetch(thread_ids)
+                
+                for thread_id in thread_ids:
+                    thread = self.thread_store.threads.get(thread_id)
+                    records = self.classify_thread(thread, days_ago) if thread else []
+                    if records:
+                        thread_records[thread_id] = records
+        
+        logger.debug("Thread scan: %d conversations evaluated", len(seen))
+        return thread_records
+
+    def classify_thread(self, thread, days_ago=30):
+        """Classify the in-window messages of a thread fetched with REPORT_METADATA_HEADERS"""
+        window_start_ms = self.window_start(days_ago).timestamp() * 1000
+        self.thread_store.threads[thread['id']] = thread
+        records = []
+        
+        messages = [msg for msg in thread.get('messages', []) if int(msg.get('internalDate', 0)) >= window_start_ms]
+        all_details = [self._parse_email_details(msg) for msg in messages]
+        
+        for msg, details, classification in zip(messages, all_details, self.classifier.classify_batch(all_details)):
+            labels = msg.get('labelIds', [])
+            if 'SENT' in labels:
+                records.extend({'bucket': bucket, 'details': details}
+                               for bucket in self.classify_sent_email(details, classification))
+            if 'INBOX' in labels:
+                records.extend({'bucket': bucket, 'details': details}
+                               for bucket in self.classify_received_email(details, classification))
         
+        if self.scan_mode == 'threads':
+            # Report a conversation once per bucket, through its latest qualifying message
+            latest = {}
+            for record in records:
+                current = latest.get(record['bucket'])
+                if current is None or record['details']['internal_date'] >= current['details']['internal_date']:
+                    latest[record['bucket']] = record
+            records = list(latest.values())
+        
+        return records
+
+    def get_changed_thread_ids(self, start_history_id):
+        """List threads touched since start_history_id, with the mailbox's current history ID"""
+        thread_ids = set()
+        page_token = None
+        
+        while True:
+            results = self.scheduler.execute(self.service.users().history().list(
+                userId='me', startHistoryId=start_history_id, pageToken=page_token
+            ))
+            
+            for record in results.get('history', []):
+                thread_ids.update(message['threadId'] for message in record.get('messages', []))
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return thread_ids, results.get('historyId', start_history_id)
+
+    def scan(self, days_ago=30):
+        """Run a full scan of the window using the configured scan mode"""
+        if self.scan_mode == 'threads':
+            return self.scan_threads(days_ago)
+        return self.scan_mailbox(days_ago)
+
+    def full_sync(self, days_ago=30):
+        """Scan the whole window and record where incremental syncs should resume"""
+        # Taken before scanning so changes made during the scan are picked up next time
+        history_id = self.scheduler.execute(self.service.users().getProfile(userId='me'))['historyId']
         return {
-            'explicit_follow_ups': explicit_follow_ups,
-            'unanswered_emails': unanswered_emails,
-            'unreplied_received': unreplied_received
-        } 
\ No newline at end of file
+            'version': SYNC_STATE_VERSION,
+            'days_ago': days_ago,
+            'scan_mode': self.scan_mode,
+            'history_id': history_id,
+            'threads': self.scan(days_ago)
+        }
+
+    def incremental_sync(self, state):
+        """Re-classify only the threads that changed since the saved history ID"""
+        thread_ids, history_id = self.get_changed_thread_ids(state['history_id'])
+        self.thread_store = ThreadStore(self.service, self.scheduler, REPORT_METADATA_HEADERS)
+        self.thread_store.prefetch(thread_ids)
+        
+        for thread_id in thread_ids:
+            thread = self.thread_store.threads.get(thread_id)
+            records = self.classify_thread(thread, state['days_ago']) if thread else []
+            if records:
+                state['threads'][thread_id] = records
+            else:
+                # Deleted threads fail to load and drop out along with threads that no longer qualify
+                state['threads'].pop(thread_id, None)
+        
+        logger.debug("Incremental sync: %d changed threads re-classified", len(thread_ids))
+        state['history_id'] = history_id
+        return state
+
+    def sync_follow_up_state(self, days_ago=30):
+        """Bring the saved per-thread classification up to date and persist it"""
+        key = account_key(self.identity.email_address)
+        state = self.state_store.load('gmail', key)
+        
+        if (state and state.get('version') == SYNC_STATE_VERSION and state.get('days_ago') == days_ago
+                and state.get('scan_mode') == self.scan_mode):
+            try:
+                state = self.incremental_sync(state)
+            except HttpError as e:
+                # Gmail only keeps history for a limited time, after which the ID is rejected
+                if e.resp.status != 404:
+                    raise
+                print("Gmail history ID expired, running a full sync")
+                state = None
+        else:
+            state = None
+        
+        if state is None:
+            state = self.full_sync(days_ago)
+        
+        self.state_store.save('gmail', key, state)
+        return state
+
+    def build_report(self, thread_records, days_ago=30):
+        """Turn per-thread classification records into the report buckets"""
+        window_start_ms = self.window_start(days_ago).timestamp() * 1000
+        report = {
+            'explicit_follow_ups': [],
+            'unanswered_emails': [],
+            'unreplied_received': []
+        }
+        
+        for records in thread_records.values():
+            for record in records:
+                details = record['details']
+                # Messages age out of the window between syncs
+                if details['internal_date'] and details['internal_date'] < window_start_ms:
+                    continue
+                if record['bucket'] == 'unreplied_received':
+                    report[record['bucket']].append(self._received_entry(details))
+                else:
+                    report[record['bucket']].append(self._sent_entry(details))
+        
+        # Sort by days waiting
+        for emails in report.values():
+            emails.sort(key=lambda x: x.get('days_waiting', 0), reverse=True)
+        
+        return report
+
+    def generate_follow_up_report(self, days_ago=30):
+        """Generate a comprehensive report of emails needing follow-up"""
+        # The scheduler is shared across reports, so measure this report's share of its counters
+        before = self.scheduler.stats()
+        
+        if self.state_store is not None:
+            thread_records = self.sync_follow_up_state(days_ago)['threads']
+        else:
+            thread_records = self.scan(days_ago)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            stats = self.scheduler.stats()
+            stats.update({key: stats[key] - before[key] for key in before if key != 'concurrency'})
+            logger.debug("Gmail scheduler: %d calls, %d quota units, %d throttled, %d retries, "
+                         "%.2fs waiting, concurrency %d", stats['calls'], stats['quota_units'],
+                         stats['throttled'], stats['retries'], stats['wait_seconds'], stats['concurrency'])
+        
+        return self.build_report(thread_records, days_ago)
@@ -0,0 +1,278 @@
+from googleapiclient.errors import HttpError
+import random
+import threading
+import time
+import metrics
+
+# Quota units per method, see https://developers.google.com/gmail/api/reference/quota
+QUOTA_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.settings.sendAs.list': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.threads.list': 10,
+    'gmail.users.threads.get': 10,
+}
+DEFAULT_QUOTA_COST = 5
+# Gmail allows 250 quota units per user per second, averaged over time
+UNITS_PER_SECOND = 250
+
+# Gmail accepts up to 100 calls per batch but recommends 50 to avoid rate limiting
+MAX_CONCURRENCY = 50
+INITIAL_CONCURRENCY = 25
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 32.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+THROTTLING_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def _error_reasons(exception):
+    return [detail.get('reason') for detail in (exception.error_details or [])
+            if isinstance(detail, dict)]
+
+
+def is_throttling_error(exception):
+    """Check if a Gmail API error means we are sending too fast"""
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status == 429:
+        return True
+    return exception.resp.status == 403 and any(
+        reason in THROTTLING_REASONS for reason in _error_reasons(exception)
+    )
+
+
+def is_retryable_error(exception):
+    """Check if a Gmail API error is transient and worth retrying"""
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status in RETRYABLE_STATUSES or is_throttling_error(exception):
+        return True
+    return exception.resp.status == 403 and 'backendError' in _error_reasons(exception)
+
+
+def method_id(request):
+    """The API method a googleapiclient request calls, such as gmail.users.messages.get"""
+    return getattr(request, 'methodId', None) or 'unknown'
+
+
+def error_status(exception):
+    """HTTP status of a failed call, for metrics"""
+    return exception.resp.status if isinstance(exception, HttpError) else 'error'
+
+
+def quota_cost(request):
+    """Quota units charged for a googleapiclient request"""
+    return QUOTA_COSTS.get(getattr(request, 'methodId', None), DEFAULT_QUOTA_COST)
+
+
+class RequestScheduler:
+    """Paces one Gmail user's calls to stay within quota and backs off when throttled
+
+    Quota units are metered with a token bucket. The number of calls in flight
+    is adjusted AIMD-style: halved whenever Gmail throttles us and raised by
+    one after a run of successful calls.
+    """
+    def __init__(self, units_per_second=UNITS_PER_SECOND, max_concurrency=MAX_CONCURRENCY,
+                 initial_concurrency=INITIAL_CONCURRENCY, max_retries=MAX_RETRIES):
+        self.units_per_second = units_per_second
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(initial_concurrency, max_concurrency)
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._tokens = float(units_per_second)
+        self._refilled_at = time.monotonic()
+        self._successes = 0
+
+        self.calls = 0
+        self.quota_units = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+    def _acquire_quota(self, units):
+        """Block until the token bucket can pay for units"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.units_per_second,
+                                   self._tokens + (now - self._refilled_at) * self.units_per_second)
+                self._refilled_at = now
+                # Requests bigger than the bucket go through once it is full and leave it
+                # in debt, so the calls after them wait until the whole cost is paid off
+                needed = min(units, self.units_per_second)
+                if self._tokens >= needed:
+                    self._tokens -= units
+                    self.quota_units += units
+                    return
+                delay = (needed - self._tokens) / self.units_per_second
+                self.wait_seconds += delay
+            time.sleep(delay)
+
+    def _acquire_slots(self, count):
+        """Block until count more calls fit under the current concurrency limit"""
+        with self._slots:
+            started = time.monotonic()
+            # A lone caller may always proceed so large batches can't deadlock
+            while self._in_flight and self._in_flight + count > self.concurrency:
+                self._slots.wait()
+            self._in_flight += count
+            self.wait_seconds += time.monotonic() - started
+
+    def _release_slots(self, count):
+        with self._slots:
+            self._in_flight -= count
+            self._slots.notify_all()
+
+    def _record_success(self, count=1):
+        with self._lock:
+            self.calls += count
+            self._successes += count
+            if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+
+    def _record_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self._successes = 0
+            self.concurrency = max(1, self.concurrency // 2)
+
+    def _backoff(self, attempt):
+        """Sleep for a jittered exponential delay before retry number attempt"""
+        delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+        with self._lock:
+            self.retries += 1
+            self.wait_seconds += delay
+        time.sleep(delay)
+
+    def _handle_error(self, exception, attempt):
+        """Return True if the failed call should be retried"""
+        if is_throttling_error(exception):
+            self._record_throttle()
+        return is_retryable_error(exception) and attempt < self.max_retries
+
+    def execute(self, request):
+        """Execute a single request, retrying transient failures"""
+        endpoint = method_id(request)
+        attempt = 0
+        while True:
+            self._acquire_quota(quota_cost(request))
+            self._acquire_slots(1)
+            started = time.perf_counter()
+            try:
+                response = request.execute()
+            except Exception as e:
+                metrics.record_upstream_call('gmail', endpoint, error_status(e), time.perf_counter() - started)
+                if not isinstance(e, HttpError) or not self._handle_error(e, attempt):
+                    raise
+            else:
+                metrics.record_upstream_call('gmail', endpoint, 200, time.perf_counter() - started)
+                self._record_success()
+                return response
+            finally:
+                self._release_slots(1)
+
+            attempt += 1
+            metrics.record_upstream_retry('gmail', endpoint)
+            self._backoff(attempt)
+
+    def execute_batch(self, service, ids, build_request):
+        """Run one request per ID through the batch endpoint, retrying transient failures
+
+        Returns a dict of responses keyed by ID. Items that fail permanently are
+        logged and left out.
+        """
+        responses = {}
+        pending = list(ids)
+        attempt = 0
+
+        while pending:
+            failed = []
+            throttled = []
+            methods = {}
+
+            def callback(request_id, response, exception):
+                metrics.record_batch_item('gmail', methods[request_id],
+                                          200 if exception is None else error_status(exception))
+                if exception is None:
+                    responses[request_id] = response
+                    self._record_success()
+                    return
+                if is_throttling_error(exception):
+                    throttled.append(request_id)
+                if is_retryable_error(exception) and attempt < self.max_retries:
+                    failed.append(request_id)
+                else:
+                    print(f"Error fetching {request_id} in batch: {str(exception)}")
+
+            start = 0
+            while start < len(pending):
+                # Batch size follows the concurrency limit, so it shrinks while throttled
+                chunk = pending[start:start + self.concurrency]
+                start += len(chunk)
+                requests = [(request_id, build_request(request_id)) for request_id in chunk]
+                methods.update((request_id, method_id(request)) for request_id, request in requests)
+
+                self._acquire_quota(sum(quota_cost(request) for _, request in requests))
+                self._acquire_slots(len(chunk))
+                started = time.perf_counter()
+                try:
+                    batch = service.new_batch_http_request(callback=callback)
+                    for request_id, request in requests:
+                        batch.add(request, request_id=request_id)
+                    batch.execute()
+                except HttpError as e:
+                    metrics.record_upstream_call('gmail', 'batch', e.resp.status, time.perf_counter() - started)
+                    # The batch request itself failed, so none of its items were answered
+                    if not self._handle_error(e, attempt):
+                        raise
+                    failed.extend(chunk)
+                else:
+                    metrics.record_upstream_call('gmail', 'batch', 200, time.perf_counter() - started)
+                finally:
+                    self._release_slots(len(chunk))
+
+                # Back off once per throttled batch rather than once per throttled item
+                if throttled:
+                    self._record_throttle()
+                    throttled.clear()
+
+            pending = failed
+            if pending:
+                attempt += 1
+                for request_id in pending:
+                    metrics.record_upstream_retry('gmail', methods[request_id])
+                self._backoff(attempt)
+
+        return responses
+
+    def stats(self):
+        """Return call, quota and waiting counters"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'quota_units': self.quota_units,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'wait_seconds': self.wait_seconds,
+                'concurrency': self.concurrency
+            }
+
+
+# Gmail quota is per user, so every report for the same account shares one scheduler
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(key):
+    """Get the shared scheduler for an account key, creating it on first use"""
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler()
+        return _schedulers[key]
@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+# Connection setup time of the current thread's last request, if it opened a new connection
+_connection_setup = threading.local()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection that records how long TCP and TLS setup took"""
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        _connection_setup.ms = (time.perf_counter() - started) * 1000
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Keep-alive adapter whose HTTPS connections report their setup time"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': HTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+
+class GraphSession(requests.Session):
+    """Pooled keep-alive session for Microsoft Graph with default timeouts
+
+    Authorization is passed per request, so one session can serve every user.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        super().__init__()
+        self.timeout = (connect_timeout, read_timeout)
+        self.mount('https://', TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        _connection_setup.ms = None
+        endpoint = metrics.endpoint_label(urlsplit(url).path)
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.record_upstream_call('outlook', endpoint, 'error', time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+        metrics.record_upstream_call('outlook', endpoint, response.status_code, elapsed)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            setup_ms = _connection_setup.ms
+            connection = 'reused connection' if setup_ms is None else f"new connection, setup {setup_ms:.1f} ms"
+            logger.debug("%s %s -> %s in %.1f ms (%s)", method, endpoint, response.status_code,
+                         elapsed * 1000, connection)
+        return response
+
+_settings = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'connect_timeout': DEFAULT_CONNECT_TIMEOUT,
+    'read_timeout': DEFAULT_READ_TIMEOUT
+}
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def configure(**settings):
+    """Change the settings used for the shared session; takes effect on its next creation"""
+    global _session
+    with _session_lock:
+        _settings.update(settings)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_graph_session():
+    """Get the worker process's shared Graph session, creating it on first use"""
+    global _session, _session_pid
+    with _session_lock:
+        # Pooled sockets must not be shared with forked worker processes
+        if _session is None or _session_pid != os.getpid():
+            _session = GraphSession(**_settings)
+            _session_pid = os.getpid()
+        return _session
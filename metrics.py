@@ -0,0 +1,251 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from worker_local import PerProcess, start_daemon
+
+# Request latency buckets in seconds, from a quick page load to a full mailbox scan
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DEFAULT_FLUSH_INTERVAL = 5
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set, named with the _total suffix"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self):
+        """This process's values as JSON-friendly [labels, value] pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(values, snapshot):
+        for key, value in snapshot:
+            values[tuple(key)] = values.get(tuple(key), 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: a count per bucket plus one for +Inf, and the running sum
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self):
+        """This process's values as JSON-friendly [labels, bucket counts, sum] triples"""
+        with self._lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+    @staticmethod
+    def merge(values, snapshot):
+        for key, counts, total in snapshot:
+            merged_counts, merged_total = values.get(tuple(key)) or ([0] * len(counts), 0.0)
+            values[tuple(key)] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+
+    def samples(self, values):
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_number(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """The metrics of every worker process, rendered in the Prometheus text format
+
+    gunicorn workers share one port, so a scrape reaches whichever worker is
+    free. When a directory is configured, each worker writes its values there
+    every flush_interval seconds and when it renders, and render adds up the
+    files of every worker, including ones that have since exited, so counters
+    never go backwards. Without a directory only this process's values are
+    rendered, which is only accurate with a single worker.
+    """
+    def __init__(self):
+        self._metrics = []
+        self.directory = None
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        # A restarted worker may get a recycled PID, so each process writes to a file of its own
+        self._process_file = PerProcess(lambda: f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        self._flusher = PerProcess(lambda: start_daemon(self._flush_loop, 'metrics-flush'))
+        # A forked worker starts from zero, or the parent's values would be counted once per worker
+        os.register_at_fork(after_in_child=self._reset)
+
+    def configure(self, directory, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def _reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+    def start(self):
+        """Start this process's flush thread, unless it is already running or there is no directory"""
+        if self.directory:
+            self._flusher.get()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing metrics: {str(e)}")
+
+    def flush(self):
+        """Write this process's values to its file in the directory"""
+        path = os.path.join(self.directory, self._process_file.get())
+        snapshot = {metric.name: metric.snapshot() for metric in self._metrics}
+        # Swapped in whole, so render never reads half a file
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(f"{path}.tmp", path)
+
+    def _snapshots(self):
+        """Every process's snapshot: this one's, plus the files of all workers if there is a directory"""
+        if not self.directory:
+            return [{metric.name: metric.snapshot() for metric in self._metrics}]
+        self.flush()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        snapshots = self._snapshots()
+        lines = []
+        for metric in self._metrics:
+            values = {}
+            for snapshot in snapshots:
+                metric.merge(values, snapshot.get(metric.name, []))
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(values))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'recap_http_request_duration_seconds', 'Time spent serving each route',
+    ['route', 'method', 'status']
+)
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    'recap_upstream_requests_total', 'Calls made to provider APIs',
+    ['provider', 'endpoint', 'status']
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'recap_upstream_request_duration_seconds', 'Time spent waiting on provider APIs',
+    ['provider', 'endpoint']
+)
+UPSTREAM_BATCH_ITEMS = REGISTRY.counter(
+    'recap_upstream_batch_items_total', 'Calls answered inside provider batch requests',
+    ['provider', 'endpoint', 'status']
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    'recap_upstream_retries_total', 'Provider API calls retried after a transient failure',
+    ['provider', 'endpoint']
+)
+PROVIDER_REPORT_LATENCY = REGISTRY.histogram(
+    'recap_provider_report_duration_seconds', 'Time each provider took to build its part of a report',
+    ['provider', 'outcome']
+)
+
+# Path segments that are IDs rather than endpoint names, so they don't explode label cardinality
+_ID_SEGMENT = re.compile(r'/(?=[^/]*[=\d])[^/]{16,}')
+
+
+def endpoint_label(path):
+    """Collapse the IDs in an API path so calls to the same endpoint share a label"""
+    return _ID_SEGMENT.sub('/{id}', path)
+
+
+def record_upstream_call(provider, endpoint, status, seconds):
+    """Count one provider API call and observe how long it took"""
+    UPSTREAM_REQUESTS.inc(provider=provider, endpoint=endpoint, status=status)
+    UPSTREAM_LATENCY.observe(seconds, provider=provider, endpoint=endpoint)
+
+
+def record_batch_item(provider, endpoint, status):
+    """Count one call answered inside a batch request, which has no latency of its own"""
+    UPSTREAM_BATCH_ITEMS.inc(provider=provider, endpoint=endpoint, status=status)
+
+
+def record_upstream_retry(provider, endpoint, count=1):
+    UPSTREAM_RETRIES.inc(count, provider=provider, endpoint=endpoint)
@@ -1,19 +1,141 @@
 from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode, urlsplit
+import hashlib
+import logging
+import random
+import threading
+import time
 import requests
 import pytz
+from classification import default_engine
+import metrics
+from graph_session import get_graph_session
+from sync_state import account_key
+
+logger = logging.getLogger(__name__)
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+# Graph accepts at most 20 sub-requests per JSON batch
+MAX_BATCH_SIZE = 20
+MAX_BATCH_RETRIES = 4
+MAX_PAGE_RETRIES = 4
+MAX_RETRY_AFTER = 60
+RETRYABLE_STATUSES = (429, 503, 504)
+# Each check keeps its own ordering and fields, so batched results match the single lookups
+RESPONSE_ORDERBY, RESPONSE_SELECT = 'receivedDateTime desc', 'from,receivedDateTime'
+REPLY_ORDERBY, REPLY_SELECT = 'receivedDateTime asc', 'from,sentDateTime'
+# Messages per page requested through the odata.maxpagesize preference
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_MAX_MESSAGES = 2000
+SENT_SELECT = 'id,subject,sentDateTime,toRecipients,conversationId'
+RECEIVED_SELECT = 'id,subject,receivedDateTime,from,conversationId'
+# Seconds a resolved user identity is reused before /me is asked again
+DEFAULT_IDENTITY_TTL = 3600
+
+SYNC_STATE_VERSION = 1
+DELTA_FOLDERS = {'SentItems': SENT_SELECT, 'Inbox': RECEIVED_SELECT}
+# One oldest-first lookup works out both reply checks for a conversation, as long as it
+# follows the lookup's next pages so the newest message is seen too
+FLAGS_ORDERBY, FLAGS_SELECT = 'receivedDateTime asc', 'from,receivedDateTime'
+FLAGS_PAGE_SIZE = 1000
+# Bulk conversation analysis only needs these, and Graph pages messages up to 1000 at a time
+BULK_SELECT = 'conversationId,from,receivedDateTime'
+BULK_PAGE_SIZE = 1000
+# 'lookup' asks Graph for each conversation, 'bulk' groups every message in the window
+CONVERSATION_ENGINES = ('lookup', 'bulk')
+# Seconds before delta sync starts over with a full sync, to pick up anything it can't see
+DEFAULT_SYNC_MAX_AGE = 7 * 24 * 3600
+# Graph rejects delta links it no longer has state for with one of these
+EXPIRED_DELTA_STATUSES = (400, 410)
+
+
+def conversation_url(conversation_id, orderby, select, top=None):
+    """Relative /me/messages URL listing one conversation, as used inside a $batch"""
+    params = {
+        '$filter': f"conversationId eq '{conversation_id}'",
+        '$orderby': orderby,
+        '$select': select
+    }
+    if top:
+        params['$top'] = top
+    return '/me/messages?' + urlencode(params, quote_via=quote, safe="$',")
+
+
+def retry_after_seconds(headers, attempt):
+    """Delay requested by a throttled response, or a jittered backoff if it gave none"""
+    value = {name.lower(): value for name, value in (headers or {}).items()}.get('retry-after')
+    try:
+        return min(MAX_RETRY_AFTER, max(0, int(value)))
+    except (TypeError, ValueError):
+        return random.uniform(0, min(MAX_RETRY_AFTER, 2 ** attempt))
+
+
+def sender_address(message):
+    """Lowercase sender address of a Graph message, or '' for drafts without one"""
+    sender = message.get('from') or {}
+    return (sender.get('emailAddress') or {}).get('address', '').lower()
+
+
+class DeltaSyncError(Exception):
+    """A delta query failed; status tells whether the delta link has expired"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class OutlookIdentity:
+    """The addresses an Outlook user receives and sends as, including proxy addresses"""
+    def __init__(self, user_principal_name, mail=None, proxy_addresses=()):
+        self.user_principal_name = user_principal_name
+        # proxyAddresses look like 'SMTP:primary@x.com' or 'smtp:alias@x.com'
+        smtp_addresses = [address.split(':', 1)[1] for address in proxy_addresses
+                          if address.lower().startswith('smtp:')]
+        self.addresses = frozenset(address.lower() for address in
+                                   (user_principal_name, mail, *smtp_addresses) if address)
+
+    def is_user_address(self, address):
+        """Check if an email address belongs to the user"""
+        return (address or '').lower() in self.addresses
+
+
+# Identities are keyed by a hash of the access token, so a refreshed token resolves again
+_identity_cache = {}
+_identity_lock = threading.Lock()
+
+
+def token_key(access_token):
+    """Stable, non-reversible cache key for an access token"""
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
 
 class OutlookFollowUpSystem:
-    def __init__(self, access_token):
+    def __init__(self, access_token, classifier=None, session=None, identity_ttl=DEFAULT_IDENTITY_TTL,
+                 page_size=DEFAULT_PAGE_SIZE, max_messages=DEFAULT_MAX_MESSAGES, state_store=None,
+                 sync_max_age=DEFAULT_SYNC_MAX_AGE, conversation_engine='lookup'):
+        if conversation_engine not in CONVERSATION_ENGINES:
+            raise ValueError(f"Unknown conversation engine: {conversation_engine}")
         self.access_token = access_token
+        self.page_size = page_size
+        # None lists every message in the window
+        self.max_messages = max_messages
+        # Optional SyncStateStore; when set, reports are kept up to date with delta queries
+        self.state_store = state_store
+        self.sync_max_age = sync_max_age
+        self.conversation_engine = conversation_engine
+        self.classifier = classifier or default_engine()
+        self.identity_ttl = identity_ttl
+        self._identity = None
+        # All Graph traffic shares the worker's pooled keep-alive session
+        self.session = session or get_graph_session()
         self.headers = {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
 
-    def _make_request(self, url, params=None):
+    def _make_request(self, url, params=None, headers=None):
         """Helper method to make requests with error handling"""
         try:
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self.session.get(url, headers={**self.headers, **(headers or {})}, params=params)
             
             # Handle 401 (unauthorized) - token might be expired
             if response.status_code == 401:
@@ -25,160 +147,572 @@ class OutlookFollowUpSystem:
             print(f"Error making request to {url}: {str(e)}")
             return None
 
+    def _get_page(self, url, params=None, headers=None):
+        """GET one page of a listing, retrying throttled and unavailable responses after their Retry-After
+        
+        Returns the response once it isn't retryable, or after the last retry.
+        """
+        attempt = 0
+        while True:
+            response = self.session.get(url, headers={**self.headers, **(headers or {})}, params=params)
+            if response.status_code not in RETRYABLE_STATUSES or attempt >= MAX_PAGE_RETRIES:
+                return response
+            delay = retry_after_seconds(response.headers, attempt)
+            metrics.record_upstream_retry('outlook', metrics.endpoint_label(urlsplit(url).path))
+            attempt += 1
+            time.sleep(delay)
+
+    def window_start(self, days_ago=30):
+        """Start of the report window in Graph's date format"""
+        return (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _iter_pages(self, url, params, page_size, limit=None):
+        """Yield pages of a collection, following @odata.nextLink lazily up to limit items
+        
+        Throttled pages are retried after their Retry-After. A page that still
+        fails raises, so a report is never built from part of a listing.
+        """
+        remaining = limit
+        if remaining is not None:
+            page_size = min(page_size, remaining)
+        params = {**params, '$top': page_size}
+        headers = {'Prefer': f'odata.maxpagesize={page_size}'}
+        
+        while url and (remaining is None or remaining > 0):
+            try:
+                response = self._get_page(url, params, headers)
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Error listing {url.split('?')[0]}: {str(e)}")
+            if response.status_code == 401:
+                raise Exception("Authentication token expired or invalid")
+            if response.status_code != 200:
+                raise Exception(f"Error listing {url.split('?')[0]}: {response.status_code}")
+            result = response.json()
+            
+            items = result.get('value', [])
+            if remaining is not None:
+                items = items[:remaining]
+                remaining -= len(items)
+            if items:
+                yield items
+            
+            # The next link already carries the query
+            url = result.get('@odata.nextLink')
+            params = None
+        
+        if url:
+            print(f"Stopped listing {url.split('?')[0]} after {limit} items")
+
+    def iter_message_pages(self, folder, date_field, select, days_ago=30):
+        """Yield pages of a folder's messages, following @odata.nextLink lazily up to max_messages"""
+        params = {
+            '$filter': f"{date_field} ge {self.window_start(days_ago)}",
+            '$select': select,
+            '$orderby': f"{date_field} desc"
+        }
+        return self._iter_pages(f"{GRAPH_URL}/me/mailFolders/{folder}/messages", params,
+                                self.page_size, self.max_messages)
+
+    def iter_sent_pages(self, days_ago=30):
+        """Yield pages of sent emails from the last 30 days, newest first"""
+        return self.iter_message_pages('SentItems', 'sentDateTime', SENT_SELECT, days_ago)
+
+    def iter_received_pages(self, days_ago=30):
+        """Yield pages of received emails from the last 30 days, newest first"""
+        return self.iter_message_pages('Inbox', 'receivedDateTime', RECEIVED_SELECT, days_ago)
+
     def get_sent_emails(self, days_ago=30):
         """Get sent emails from the last 30 days"""
+        return [email for page in self.iter_sent_pages(days_ago) for email in page]
+
+    def _post_batch(self, requests_by_id):
+        """POST one JSON batch and return its sub-responses keyed by id
+        
+        If the whole batch is throttled, every sub-request gets that status so
+        the caller retries them all.
+        """
+        body = {'requests': [{'id': request_id, 'method': 'GET', 'url': url}
+                             for request_id, url in requests_by_id.items()]}
         try:
-            date_filter = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%SZ')
-            
-            url = "https://graph.microsoft.com/v1.0/me/mailFolders/SentItems/messages"
-            params = {
-                '$filter': f"sentDateTime ge {date_filter}",
-                '$select': 'id,subject,sentDateTime,toRecipients,conversationId',
-                '$orderby': 'sentDateTime desc',
-                '$top': 50
-            }
-            
-            result = self._make_request(url, params)
-            return result.get('value', []) if result else []
+            response = self.session.post(f"{GRAPH_URL}/$batch", headers=self.headers, json=body)
+        except requests.exceptions.RequestException as e:
+            print(f"Error sending batch request: {str(e)}")
+            return {}
+        
+        if response.status_code == 401:
+            raise Exception("Authentication token expired or invalid")
+        if response.status_code in RETRYABLE_STATUSES:
+            return {request_id: {'status': response.status_code, 'headers': dict(response.headers)}
+                    for request_id in requests_by_id}
+        if response.status_code != 200:
+            print(f"Error sending batch request: {response.status_code}")
+            return {}
+        return {sub['id']: sub for sub in response.json().get('responses', [])}
+
+    def _collect_batch(self, chunk, responses, urls, attempt, results, retry):
+        """Sort a batch's sub-responses into results and retries
+        
+        Returns how long to wait before retrying, if anything needs it.
+        """
+        delay = 0
+        for request_id, key in chunk.items():
+            sub = responses.get(request_id)
+            status = sub.get('status') if sub else None
+            endpoint = metrics.endpoint_label(urlsplit(urls[key]).path)
+            metrics.record_batch_item('outlook', endpoint, status or 'error')
+            if status == 200:
+                results[key] = sub.get('body') or {}
+            elif status == 401:
+                raise Exception("Authentication token expired or invalid")
+            elif status in RETRYABLE_STATUSES and attempt < MAX_BATCH_RETRIES:
+                retry[key] = urls[key]
+                metrics.record_upstream_retry('outlook', endpoint)
+                delay = max(delay, retry_after_seconds(sub.get('headers'), attempt))
+            else:
+                print(f"Error in batched request {urls[key]}: {status}")
+        return delay
+
+    def batch_get(self, urls):
+        """GET many relative Graph URLs through $batch
+        
+        urls maps a caller key to a relative URL. Returns the response bodies
+        keyed the same way; throttled sub-requests are retried after their
+        Retry-After, and ones that still fail are logged and left out.
+        """
+        results = {}
+        pending = dict(urls)
+        attempt = 0
+        
+        while pending:
+            retry = {}
+            delay = 0
+            keys = list(pending)
+            for start in range(0, len(keys), MAX_BATCH_SIZE):
+                # Sub-request ids only need to be unique within their batch
+                chunk = {str(i): key for i, key in enumerate(keys[start:start + MAX_BATCH_SIZE])}
+                responses = self._post_batch({request_id: pending[key] for request_id, key in chunk.items()})
+                delay = max(delay, self._collect_batch(chunk, responses, pending, attempt, results, retry))
             
-        except Exception as e:
-            print(f"Error getting sent emails: {str(e)}")
-            return []
+            pending = retry
+            if pending:
+                attempt += 1
+                time.sleep(delay)
+        
+        return results
+
+    def get_conversations(self, conversation_ids, orderby, select, top=None):
+        """Get the messages of many conversations, batched 20 lookups per round trip
+        
+        Only the first page of each conversation is fetched, unless top is
+        given: then every page is, top messages at a time. Conversations whose
+        lookup failed are left out, which the checks treat like an empty
+        conversation, as the single lookups did.
+        """
+        urls = {conversation_id: conversation_url(conversation_id, orderby, select, top)
+                for conversation_id in dict.fromkeys(conversation_ids)}
+        conversations = {}
+        while urls:
+            results = self.batch_get(urls)
+            next_urls = {}
+            for conversation_id in urls:
+                body = results.get(conversation_id)
+                if body is None:
+                    # Half a conversation would give wrong answers, so leave all of it out
+                    conversations.pop(conversation_id, None)
+                    continue
+                conversations.setdefault(conversation_id, []).extend(body.get('value', []))
+                next_link = body.get('@odata.nextLink')
+                if top and next_link:
+                    # $batch takes URLs relative to the Graph version root
+                    next_urls[conversation_id] = next_link[len(GRAPH_URL):] if next_link.startswith(GRAPH_URL) else next_link
+            urls = next_urls
+        return conversations
+
+    def _has_response(self, messages, addresses):
+        """Check a conversation, newest message first, for a response from someone else"""
+        if len(messages) > 1:  # More than just the sent message
+            latest_message = messages[0]
+            # Check if the latest message is from someone else (drafts have no sender)
+            sender = sender_address(latest_message)
+            return bool(sender) and sender not in addresses
+        return False
 
     def check_for_response(self, conversation_id):
         """Check if there's been a response in the conversation"""
-        url = f"https://graph.microsoft.com/v1.0/me/messages"
+        url = f"{GRAPH_URL}/me/messages"
         params = {
             '$filter': f"conversationId eq '{conversation_id}'",
-            '$orderby': 'receivedDateTime desc',
-            '$select': 'from,receivedDateTime'
+            '$orderby': RESPONSE_ORDERBY,
+            '$select': RESPONSE_SELECT
         }
         
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self.session.get(url, headers=self.headers, params=params)
         if response.status_code == 200:
             messages = response.json().get('value', [])
-            if len(messages) > 1:  # More than just the sent message
-                latest_message = messages[0]
-                # Check if the latest message is from someone else
-                return latest_message['from']['emailAddress']['address'] != self.get_user_email()
+            return self._has_response(messages, self.identity.addresses)
         return False
 
+    @property
+    def identity(self):
+        """The user's identity, resolved once per token and reused for identity_ttl seconds"""
+        if self._identity is None:
+            self._identity = self._get_identity()
+        return self._identity
+
+    def _get_identity(self):
+        key = token_key(self.access_token)
+        now = time.monotonic()
+        with _identity_lock:
+            cached = _identity_cache.get(key)
+            if cached and cached[1] > now:
+                return cached[0]
+        
+        params = {'$select': 'userPrincipalName,mail,proxyAddresses'}
+        response = self.session.get(f"{GRAPH_URL}/me", headers=self.headers, params=params)
+        if response.status_code != 200:
+            # Don't cache a failed lookup; reply checks just won't recognize the user
+            print(f"Error getting user identity: {response.status_code}")
+            return OutlookIdentity('')
+        
+        user = response.json()
+        identity = OutlookIdentity(user.get('userPrincipalName', ''), user.get('mail'),
+                                   user.get('proxyAddresses') or [])
+        with _identity_lock:
+            # Drop expired entries so tokens that are never seen again don't pile up
+            for stale in [k for k, (_, expires_at) in _identity_cache.items() if expires_at <= now]:
+                del _identity_cache[stale]
+            _identity_cache[key] = (identity, now + self.identity_ttl)
+        return identity
+
     def get_user_email(self):
         """Get the current user's email address"""
-        url = "https://graph.microsoft.com/v1.0/me"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            return response.json().get('userPrincipalName', '')
-        return ''
+        return self.identity.user_principal_name
+
+    def get_days_waiting(self, date):
+        """Whole days since a Graph timestamp"""
+        sent_date = datetime.strptime(date, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=pytz.UTC)
+        return (datetime.now(pytz.UTC) - sent_date).days
+
+    def _sent_entry(self, email):
+        return {
+            'subject': email['subject'],
+            'to': '; '.join(r['emailAddress']['address'] 
+                          for r in email['toRecipients']),
+            'date': email['sentDateTime'],
+            'days_waiting': self.get_days_waiting(email['sentDateTime'])
+        }
+
+    def _received_entry(self, email):
+        return {
+            'subject': email['subject'],
+            'from': email['from']['emailAddress']['address'],
+            'date': email['receivedDateTime'],
+            'days_waiting': self.get_days_waiting(email['receivedDateTime'])
+        }
 
     def check_unanswered_sent_emails(self, days_ago=30):
         """Check for all sent emails that haven't received responses"""
-        sent_emails = self.get_sent_emails(days_ago)
         unanswered_emails = []
+        # Conversations looked up so far, shared across pages
+        conversations = {}
+        addresses = self.identity.addresses
         
-        for email in sent_emails:
-            if not self.check_for_response(email['conversationId']):
-                sent_date = datetime.strptime(
-                    email['sentDateTime'], 
-                    '%Y-%m-%dT%H:%M:%SZ'
-                ).replace(tzinfo=pytz.UTC)
-                
-                days_waiting = (datetime.now(pytz.UTC) - sent_date).days
-                
-                unanswered_emails.append({
-                    'subject': email['subject'],
-                    'to': '; '.join(r['emailAddress']['address'] 
-                                  for r in email['toRecipients']),
-                    'date': email['sentDateTime'],
-                    'days_waiting': days_waiting
-                })
+        for sent_emails in self.iter_sent_pages(days_ago):
+            conversations.update(self.get_conversations(
+                (email['conversationId'] for email in sent_emails
+                 if email['conversationId'] not in conversations),
+                RESPONSE_ORDERBY, RESPONSE_SELECT
+            ))
+            
+            for email in sent_emails:
+                messages = conversations.get(email['conversationId'], [])
+                if not self._has_response(messages, addresses):
+                    unanswered_emails.append(self._sent_entry(email))
         
         return unanswered_emails
 
     def get_received_emails(self, days_ago=30):
         """Get received emails from the last 30 days"""
-        date_filter = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%SZ')
-        
-        url = "https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages"
-        params = {
-            '$filter': f"receivedDateTime ge {date_filter}",
-            '$select': 'id,subject,receivedDateTime,from,conversationId',
-            '$orderby': 'receivedDateTime desc',
-            '$top': 50
-        }
-        
-        response = requests.get(url, headers=self.headers, params=params)
-        if response.status_code == 200:
-            return response.json().get('value', [])
-        return []
+        return [email for page in self.iter_received_pages(days_ago) for email in page]
     
     def check_unreplied_received_emails(self, days_ago=30):
         """Check for received emails that haven't been replied to"""
-        received_emails = self.get_received_emails(days_ago)
         unreplied_emails = []
+        # Conversations looked up so far, shared across pages
+        conversations = {}
+        addresses = self.identity.addresses
         
-        user_email = self.get_user_email()
-        
-        for email in received_emails:
-            # Skip if promotional or automated
-            subject = email['subject'].lower()
-            from_address = email['from']['emailAddress']['address'].lower()
-            
-            if any(keyword in subject for keyword in ['newsletter', 'promotion', 'sale', 'offer']):
-                continue
-                
-            if any(keyword in from_address for keyword in ['noreply', 'no-reply', 'donotreply', 'newsletter']):
-                continue
+        for received_emails in self.iter_received_pages(days_ago):
+            classifications = self.classifier.classify_batch(
+                {'subject': email['subject'], 'from': email['from']['emailAddress']['address']}
+                for email in received_emails
+            )
             
-            # Check if user has replied
-            has_replied = self.check_if_replied(email['conversationId'], user_email)
+            # Skip if promotional or automated
+            candidates = [email for email, classification in zip(received_emails, classifications)
+                          if not classification.is_automated]
+            conversations.update(self.get_conversations(
+                (email['conversationId'] for email in candidates
+                 if email['conversationId'] not in conversations),
+                REPLY_ORDERBY, REPLY_SELECT
+            ))
             
-            if not has_replied:
-                sent_date = datetime.strptime(
-                    email['receivedDateTime'], 
-                    '%Y-%m-%dT%H:%M:%SZ'
-                ).replace(tzinfo=pytz.UTC)
-                
-                days_waiting = (datetime.now(pytz.UTC) - sent_date).days
+            for email in candidates:
+                # Check if user has replied
+                has_replied = self._has_replied(conversations.get(email['conversationId'], []), addresses)
                 
-                unreplied_emails.append({
-                    'subject': email['subject'],
-                    'from': email['from']['emailAddress']['address'],
-                    'date': email['receivedDateTime'],
-                    'days_waiting': days_waiting
-                })
+                if not has_replied:
+                    unreplied_emails.append(self._received_entry(email))
         
         return unreplied_emails
     
-    def check_if_replied(self, conversation_id, user_email):
-        """Check if the user has replied to this conversation"""
-        url = f"https://graph.microsoft.com/v1.0/me/messages"
+    def _has_replied(self, messages, addresses):
+        """Check a conversation, oldest message first, for a reply from the user"""
+        if len(messages) <= 1:
+            return False
+            
+        # Check if any messages after the first are from the user
+        for i in range(1, len(messages)):
+            if sender_address(messages[i]) in addresses:
+                return True
+                
+        return False
+
+    def check_if_replied(self, conversation_id, user_email=None):
+        """Check if the user has replied to this conversation
+        
+        Matches any of the user's addresses unless a single user_email is given.
+        """
+        url = f"{GRAPH_URL}/me/messages"
         params = {
             '$filter': f"conversationId eq '{conversation_id}'",
-            '$orderby': 'receivedDateTime asc',
-            '$select': 'from,sentDateTime'
+            '$orderby': REPLY_ORDERBY,
+            '$select': REPLY_SELECT
         }
         
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self.session.get(url, headers=self.headers, params=params)
         if response.status_code == 200:
             messages = response.json().get('value', [])
-            
-            if len(messages) <= 1:
-                return False
-                
-            # Check if any messages after the first are from the user
-            for i in range(1, len(messages)):
-                if messages[i]['from']['emailAddress']['address'].lower() == user_email.lower():
-                    return True
-                    
-            return False
+            addresses = {user_email.lower()} if user_email else self.identity.addresses
+            return self._has_replied(messages, addresses)
         return False
     
-    def generate_follow_up_report(self):
+    def _get_delta_page(self, url, params=None):
+        """Get one page of a delta query, raising DeltaSyncError if it fails"""
+        headers = {'Prefer': f'odata.maxpagesize={self.page_size}'}
+        try:
+            response = self._get_page(url, params, headers)
+        except requests.exceptions.RequestException as e:
+            raise DeltaSyncError(None, f"Error making delta request: {str(e)}")
+        
+        if response.status_code == 401:
+            raise Exception("Authentication token expired or invalid")
+        if response.status_code != 200:
+            raise DeltaSyncError(response.status_code, f"Delta request failed: {response.status_code}")
+        return response.json()
+
+    def _apply_delta(self, folder_state, url, params=None):
+        """Apply every page of a folder's delta query to its saved messages
+        
+        Returns the deltaLink to resume from and the conversations whose
+        messages changed.
+        """
+        messages = folder_state['messages']
+        changed = set()
+        
+        while True:
+            result = self._get_delta_page(url, params)
+            for item in result.get('value', []):
+                old = messages.pop(item['id'], None)
+                if old:
+                    changed.add(old.get('conversationId'))
+                if '@removed' in item:
+                    continue
+                # Updates may only carry the properties that changed
+                message = {**(old or {}), **{k: v for k, v in item.items() if not k.startswith('@')}}
+                messages[item['id']] = message
+                changed.add(message.get('conversationId'))
+            
+            if '@odata.deltaLink' in result:
+                return result['@odata.deltaLink'], changed
+            # The next link already carries the query
+            url = result['@odata.nextLink']
+            params = None
+
+    def _conversation_flags(self, conversations):
+        """Decide both reply checks for conversations whose messages are listed oldest first"""
+        addresses = self.identity.addresses
+        return {
+            conversation_id: {
+                'responded': self._has_response(messages[::-1], addresses),
+                'replied': self._has_replied(messages, addresses)
+            }
+            for conversation_id, messages in conversations.items()
+        }
+
+    def get_conversation_flags(self, conversation_ids):
+        """Work out both reply checks for many conversations with one batched lookup each
+        
+        Every page of each conversation is read, so the newest message is
+        judged however long the conversation is. Conversations whose lookup
+        failed are left out, so they are looked up again on the next sync.
+        """
+        return self._conversation_flags(
+            self.get_conversations(conversation_ids, FLAGS_ORDERBY, FLAGS_SELECT, top=FLAGS_PAGE_SIZE)
+        )
+
+    def get_window_conversation_flags(self, days_ago=30):
+        """Work out both reply checks for every conversation active in the window, in bulk
+        
+        Lists every message received in the window from all folders and groups
+        them by conversation, so the number of round trips follows the number
+        of pages rather than conversations. Messages from before the window are
+        not seen: a conversation that started earlier is judged on its messages
+        inside the window only, so an old exchange that the window cuts through
+        can look different than it does to the per-conversation lookups.
+        """
+        params = {'$filter': f"receivedDateTime ge {self.window_start(days_ago)}", '$select': BULK_SELECT}
+        conversations = {}
+        for page in self._iter_pages(f"{GRAPH_URL}/me/messages", params, BULK_PAGE_SIZE):
+            for message in page:
+                conversations.setdefault(message.get('conversationId'), []).append(message)
+        conversations.pop(None, None)
+        
+        for messages in conversations.values():
+            messages.sort(key=lambda message: message.get('receivedDateTime') or '')
+        return self._conversation_flags(conversations)
+
+    def _update_conversations(self, state, changed):
+        """Refresh the flags of changed conversations and forget ones no message refers to any more"""
+        window_start = self.window_start(state['days_ago'])
+        referenced = set()
+        for folder, folder_state in state['folders'].items():
+            date_field = 'sentDateTime' if folder == 'SentItems' else 'receivedDateTime'
+            # Messages age out of the window between syncs
+            folder_state['messages'] = {
+                message_id: message for message_id, message in folder_state['messages'].items()
+                if (message.get(date_field) or '') >= window_start
+            }
+            referenced.update(message.get('conversationId') for message in folder_state['messages'].values())
+        referenced.discard(None)
+        
+        conversations = {conversation_id: flags for conversation_id, flags in state['conversations'].items()
+                         if conversation_id in referenced and conversation_id not in changed}
+        stale = [conversation_id for conversation_id in referenced if conversation_id not in conversations]
+        conversations.update(self.get_conversation_flags(stale))
+        state['conversations'] = conversations
+        return len(stale)
+
+    def full_sync(self, days_ago=30):
+        """Load both folders' messages in the window with delta queries and classify every conversation
+        
+        Delta queries must run to the end to hand out a deltaLink, so
+        max_messages does not apply here.
+        """
+        state = {
+            'version': SYNC_STATE_VERSION,
+            'days_ago': days_ago,
+            'full_synced_at': time.time(),
+            'folders': {},
+            # Bulk flags cover the whole window; anything they miss is looked up below
+            'conversations': self.get_window_conversation_flags(days_ago) if self.conversation_engine == 'bulk' else {}
+        }
+        for folder, select in DELTA_FOLDERS.items():
+            folder_state = {'messages': {}}
+            url = f"{GRAPH_URL}/me/mailFolders/{folder}/messages/delta"
+            # receivedDateTime is the only property delta queries can filter on
+            params = {'$select': select, '$filter': f"receivedDateTime ge {self.window_start(days_ago)}"}
+            folder_state['delta_link'], _ = self._apply_delta(folder_state, url, params)
+            state['folders'][folder] = folder_state
+        
+        self._update_conversations(state, set())
+        return state
+
+    def incremental_sync(self, state):
+        """Pull only messages changed since the saved deltaLinks and re-check their conversations"""
+        changed = set()
+        for folder_state in state['folders'].values():
+            folder_state['delta_link'], folder_changed = self._apply_delta(folder_state, folder_state['delta_link'])
+            changed.update(folder_changed)
+        changed.discard(None)
+        
+        checked = self._update_conversations(state, changed)
+        logger.debug("Incremental sync: %d changed conversations, %d re-checked", len(changed), checked)
+        return state
+
+    def sync_follow_up_state(self, days_ago=30):
+        """Bring the saved per-conversation state up to date and persist it"""
+        key = account_key(self.identity.user_principal_name)
+        state = self.state_store.load('outlook', key)
+        
+        if (state and state.get('version') == SYNC_STATE_VERSION and state.get('days_ago') == days_ago
+                and time.time() - state.get('full_synced_at', 0) < self.sync_max_age):
+            try:
+                state = self.incremental_sync(state)
+            except DeltaSyncError as e:
+                if e.status not in EXPIRED_DELTA_STATUSES:
+                    raise
+                print("Outlook delta link expired, running a full sync")
+                state = None
+        else:
+            state = None
+        
+        if state is None:
+            state = self.full_sync(days_ago)
+        
+        self.state_store.save('outlook', key, state)
+        return state
+
+    def build_report(self, sent_emails, received_emails, conversations):
+        """Turn sent and received emails plus their conversation flags into the report buckets"""
+        unanswered_emails = [
+            self._sent_entry(email) for email in sent_emails
+            if not conversations.get(email.get('conversationId'), {}).get('responded')
+        ]
+        
+        received_emails = list(received_emails)
+        classifications = self.classifier.classify_batch(
+            {'subject': email['subject'], 'from': email['from']['emailAddress']['address']}
+            for email in received_emails
+        )
+        unreplied_received = [
+            self._received_entry(email) for email, classification in zip(received_emails, classifications)
+            if not classification.is_automated
+            and not conversations.get(email.get('conversationId'), {}).get('replied')
+        ]
+        return unanswered_emails, unreplied_received
+
+    def generate_follow_up_report(self, days_ago=30):
         """Generate a comprehensive report of emails needing follow-up"""
-        unanswered_emails = self.check_unanswered_sent_emails()
-        unreplied_received = self.check_unreplied_received_emails()
+        # Without a resolved identity there is no account to key saved state by
+        if self.state_store is not None and self.identity.user_principal_name:
+            try:
+                state = self.sync_follow_up_state(days_ago)
+            except DeltaSyncError as e:
+                print(f"Outlook delta sync failed, scanning instead: {str(e)}")
+                state = None
+        else:
+            state = None
+        
+        if state is not None:
+            unanswered_emails, unreplied_received = self.build_report(
+                state['folders']['SentItems']['messages'].values(),
+                state['folders']['Inbox']['messages'].values(),
+                state['conversations']
+            )
+        elif self.conversation_engine == 'bulk':
+            unanswered_emails, unreplied_received = self.build_report(
+                self.get_sent_emails(days_ago),
+                self.get_received_emails(days_ago),
+                self.get_window_conversation_flags(days_ago)
+            )
+        else:
+            unanswered_emails = self.check_unanswered_sent_emails(days_ago)
+            unreplied_received = self.check_unreplied_received_emails(days_ago)
         
+        return self._follow_up_report(unanswered_emails, unreplied_received)
+
+    def _follow_up_report(self, unanswered_emails, unreplied_received):
         # Sort by days waiting
         unanswered_emails.sort(key=lambda x: x['days_waiting'], reverse=True)
         unreplied_received.sort(key=lambda x: x['days_waiting'], reverse=True)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import time
+
+from worker_local import SQLiteConnections
+
+DEFAULT_TTL = 300
+# Entries older than this are not served at all, not even while refreshing
+DEFAULT_MAX_STALE = 24 * 3600
+DEFAULT_MAX_ENTRIES = 500
+# Seconds one worker may spend refreshing an entry before another may try
+REFRESH_LEASE = 300
+
+
+class CachedReport:
+    """A cached provider report and when it was generated"""
+    def __init__(self, report, created_at, etag):
+        self.report = report
+        self.created_at = created_at
+        self.etag = etag
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+
+class ReportCache:
+    """Provider reports cached in SQLite, shared by every worker process on the host
+
+    The database runs in WAL mode so readers never wait for a writer. Each
+    entry is a JSON report with its creation time, last access time and an
+    ETag of its content; the least recently used entries are evicted once
+    there are more than max_entries.
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL, max_stale=DEFAULT_MAX_STALE, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._connections = SQLiteConnections(path)
+        with self._connections.get() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                " key TEXT PRIMARY KEY,"
+                " report TEXT NOT NULL,"
+                " etag TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " refreshing_until REAL NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS reports_accessed_at ON reports (accessed_at)")
+
+    @staticmethod
+    def key(provider, account, days_ago):
+        """Cache key for one provider account and report window"""
+        return f"{provider}:{hashlib.sha256(account.encode()).hexdigest()}:{days_ago}"
+
+    def get(self, key):
+        """Return the cached report, fresh or stale, or None if there is no servable entry"""
+        now = time.time()
+        with self._connections.get() as db:
+            row = db.execute("SELECT report, created_at, etag FROM reports WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_stale:
+                db.execute("DELETE FROM reports WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE reports SET accessed_at = ? WHERE key = ?", (now, key))
+        return CachedReport(json.loads(row[0]), row[1], row[2])
+
+    def is_fresh(self, entry):
+        return entry.age < self.ttl
+
+    def put(self, key, report):
+        """Store a report and evict the least recently used entries beyond max_entries"""
+        payload = json.dumps(report, separators=(',', ':'), default=str)
+        etag = hashlib.sha256(payload.encode()).hexdigest()[:32]
+        now = time.time()
+        with self._connections.get() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO reports (key, report, etag, created_at, accessed_at, refreshing_until)"
+                " VALUES (?, ?, ?, ?, ?, 0)",
+                (key, payload, etag, now, now)
+            )
+            db.execute(
+                "DELETE FROM reports WHERE key IN"
+                " (SELECT key FROM reports ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        return etag
+
+    def claim_refresh(self, key):
+        """Claim the right to refresh an entry, so only one worker refreshes it at a time"""
+        now = time.time()
+        with self._connections.get() as db:
+            claimed = db.execute(
+                "UPDATE reports SET refreshing_until = ? WHERE key = ? AND refreshing_until < ?",
+                (now + REFRESH_LEASE, key, now)
+            ).rowcount
+        return claimed == 1
+
+    def release_refresh(self, key):
+        """Give up a refresh claim without storing a new report"""
+        with self._connections.get() as db:
+            db.execute("UPDATE reports SET refreshing_until = 0 WHERE key = ?", (key,))
+
+    def invalidate(self, key):
+        """Drop an entry so the next report is generated from scratch"""
+        with self._connections.get() as db:
+            db.execute("DELETE FROM reports WHERE key = ?", (key,))
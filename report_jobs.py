@@ -0,0 +1,171 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+import traceback
+import uuid
+
+from worker_local import SQLiteConnections
+
+DEFAULT_WORKERS = 4
+# Seconds a finished job's result stays available to its status and result pages
+DEFAULT_RESULT_TTL = 600
+# A job that hasn't been updated for this many seconds is taken as lost with the
+# worker process that ran it; longer than any provider is allowed to take
+JOB_LEASE = 300
+COLUMNS = 'id, key, status, progress, result, error, created_at, finished_at'
+
+
+class ReportJob:
+    """One report being generated in the background"""
+    def __init__(self, key, runner=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self._progress = 'Waiting to start'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._runner = runner
+
+    @classmethod
+    def from_row(cls, row):
+        """A job as read back from a row of COLUMNS"""
+        job = cls(tuple(json.loads(row[1])))
+        job.id, job.status, job._progress, job.error, job.created_at, job.finished_at = (
+            row[0], row[2], row[3], row[5], row[6], row[7]
+        )
+        job.result = json.loads(row[4]) if row[4] is not None else None
+        return job
+
+    @property
+    def progress(self):
+        return self._progress
+
+    @progress.setter
+    def progress(self, progress):
+        # Written through, so a status poll answered by another worker sees it
+        self._progress = progress
+        if self._runner is not None:
+            self._runner._update(self, progress=progress)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        """Status fields safe to show to the job's owner"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'elapsed_seconds': round((self.finished_at or time.time()) - self.created_at, 1)
+        }
+
+
+class ReportJobRunner:
+    """Runs report jobs on a local thread pool and keeps their state in SQLite
+
+    Job status and results are shared by every worker process on the host, so
+    status polls can reach any of them. Only one job per account key is queued
+    or running at a time; submitting another while it is returns the existing
+    job, whichever worker runs it.
+    """
+    def __init__(self, path, max_workers=DEFAULT_WORKERS, result_ttl=DEFAULT_RESULT_TTL):
+        self.path = path
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-job')
+        self._connections = SQLiteConnections(path)
+        with self._connections.get() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS report_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " key TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " progress TEXT NOT NULL,"
+                " result TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " finished_at REAL,"
+                " updated_at REAL NOT NULL)"
+            )
+            # At most one queued or running job per key across every worker
+            db.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS report_jobs_active_key ON report_jobs (key)"
+                " WHERE status IN ('queued', 'running')"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS report_jobs_key ON report_jobs (key, created_at)")
+
+    def submit(self, key, fn, *args):
+        """Run fn(job, *args) in the background, reusing the account's job if one is in progress"""
+        job = ReportJob(key, runner=self)
+        encoded_key = json.dumps(list(key))
+        with self._connections.get() as db:
+            self._prune(db)
+            while not db.execute(
+                "INSERT OR IGNORE INTO report_jobs (id, key, status, progress, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, encoded_key, job.status, job.progress, job.created_at, job.created_at)
+            ).rowcount:
+                row = db.execute(
+                    f"SELECT {COLUMNS} FROM report_jobs WHERE key = ? AND status IN ('queued', 'running')",
+                    (encoded_key,)
+                ).fetchone()
+                # Otherwise it finished in the meantime, so try again
+                if row is not None:
+                    return ReportJob.from_row(row)
+
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        """Return a job by ID, or None if it is unknown or has expired"""
+        with self._connections.get() as db:
+            self._prune(db)
+            row = db.execute(f"SELECT {COLUMNS} FROM report_jobs WHERE id = ?", (job_id,)).fetchone()
+        return ReportJob.from_row(row) if row is not None else None
+
+    def latest(self, key):
+        """Return the most recent job for a key, running or finished, or None"""
+        with self._connections.get() as db:
+            self._prune(db)
+            row = db.execute(
+                f"SELECT {COLUMNS} FROM report_jobs WHERE key = ? ORDER BY created_at DESC LIMIT 1",
+                (json.dumps(list(key)),)
+            ).fetchone()
+        return ReportJob.from_row(row) if row is not None else None
+
+    def _update(self, job, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._connections.get() as db:
+            db.execute(f"UPDATE report_jobs SET {assignments} WHERE id = ?", (*fields.values(), job.id))
+
+    def _run(self, job, fn, args):
+        job.status = 'running'
+        self._update(job, status='running')
+        job.progress = 'Starting'
+        try:
+            job.result = fn(job, *args)
+            job.status = 'done'
+            job.progress = 'Done'
+        except Exception as e:
+            print(f"Report job {job.id} failed: {str(e)}\n{traceback.format_exc()}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            self._update(job, status=job.status, error=job.error, finished_at=job.finished_at,
+                         result=json.dumps(job.result, separators=(',', ':'), default=str)
+                         if job.result is not None else None)
+
+    def _prune(self, db):
+        """Fail jobs whose worker went away and forget finished jobs older than result_ttl"""
+        now = time.time()
+        db.execute(
+            "UPDATE report_jobs SET status = 'failed', error = ?, finished_at = ?"
+            " WHERE status IN ('queued', 'running') AND updated_at < ?",
+            ("The worker generating this report stopped, please try again", now, now - JOB_LEASE)
+        )
+        db.execute("DELETE FROM report_jobs WHERE finished_at < ?", (now - self.result_ttl,))
@@ -0,0 +1,198 @@
+import secrets
+import sqlite3
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+import msgspec
+
+from worker_local import PerProcess, SQLiteConnections, start_daemon
+
+DEFAULT_CLEANUP_INTERVAL = 300
+# Expiry is only pushed back once this fraction of the lifetime has passed, so
+# sessions that are just read aren't rewritten on every request
+RENEW_FRACTION = 0.5
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder()
+
+
+class StoredSession(SessionMixin):
+    """A session whose data is only read from the store when a request first touches it"""
+    def __init__(self, store, session_id=None, new=False):
+        self.store = store
+        self.sid = session_id
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.expires_at = None
+        self._data = {} if new else None
+
+    def _load(self):
+        self.accessed = True
+        if self._data is None:
+            data, self.expires_at = self.store.load(self.sid) if self.sid else (None, None)
+            if data is None:
+                # Unknown or expired: carry on with a fresh, empty session
+                self.sid = None
+                self.new = True
+            self._data = data or {}
+        return self._data
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return f"<StoredSession {self._data if self.loaded else '(not loaded)'}>"
+
+
+class SQLiteSessionStore:
+    """Session data in an SQLite database shared by every worker process on the host
+
+    The database runs in WAL mode so reads never wait for a writer. Data is
+    stored as msgpack, and expired sessions are deleted by a background thread
+    in each worker process.
+    """
+    def __init__(self, path, cleanup_interval=DEFAULT_CLEANUP_INTERVAL):
+        self.path = path
+        self.cleanup_interval = cleanup_interval
+        self._connections = SQLiteConnections(path)
+        self._cleaner = PerProcess(lambda: start_daemon(self._cleanup_loop, 'session-cleanup'))
+        with self._connections.get() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY,"
+                " data BLOB NOT NULL,"
+                " expires_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def load(self, session_id):
+        """Return a session's data and expiry time, or (None, None) if it is unknown or expired"""
+        row = self._connections.get().execute(
+            "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+        if row is None:
+            return None, None
+        return _decoder.decode(row[0]), row[1]
+
+    def save(self, session_id, data, expires_at):
+        with self._connections.get() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, _encoder.encode(data), expires_at)
+            )
+
+    def touch(self, session_id, expires_at):
+        """Push back a session's expiry without rewriting its data"""
+        with self._connections.get() as db:
+            db.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, session_id))
+
+    def delete(self, session_id):
+        with self._connections.get() as db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def delete_expired(self):
+        """Delete every expired session and return how many there were"""
+        with self._connections.get() as db:
+            return db.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def start_cleanup(self):
+        """Start this process's cleanup thread, unless it is already running"""
+        self._cleaner.get()
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(self.cleanup_interval)
+            try:
+                self.delete_expired()
+            except sqlite3.Error as e:
+                print(f"Error deleting expired sessions: {str(e)}")
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Server-side Flask sessions kept in a SQLiteSessionStore
+
+    The cookie only holds the signed session ID. Session data is read the
+    first time a request uses it and written back only when it changed, so
+    requests that don't touch the session never reach the database.
+    """
+    def __init__(self, store, salt='recap-session'):
+        self.store = store
+        self.salt = salt
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        self.store.start_cleanup()
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return StoredSession(self.store, new=True)
+        try:
+            session_id = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return StoredSession(self.store, new=True)
+        return StoredSession(self.store, session_id)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session.loaded:
+            return
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # Cleared or never used: drop whatever was stored
+            if session.modified and session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       partitioned=self.get_cookie_partitioned(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        expires_at = time.time() + lifetime
+        if session.modified or session.sid is None:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+            self.store.save(session.sid, dict(session), expires_at)
+        elif session.expires_at - time.time() < lifetime * RENEW_FRACTION:
+            self.store.touch(session.sid, expires_at)
+        else:
+            return
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            partitioned=self.get_cookie_partitioned(app),
+            samesite=self.get_cookie_samesite(app)
+        )
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+def account_key(address):
+    """Stable file-safe key for an account address"""
+    return hashlib.sha256(address.lower().encode()).hexdigest()
+
+
+class SyncStateStore:
+    """Persists incremental sync state for each connected account as JSON files"""
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, provider, key):
+        return os.path.join(self.directory, provider, f"{key}.json")
+
+    def load(self, provider, key):
+        """Return the saved state for an account, or None if there isn't any usable state"""
+        try:
+            with open(self._path(provider, key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error loading {provider} sync state: {str(e)}")
+            return None
+
+    def save(self, provider, key, state):
+        """Atomically replace the saved state for an account"""
+        path = self._path(provider, key)
+        directory = os.path.dirname(path)
+
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temp file first so a crash never leaves half a state file behind
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f, separators=(',', ':'))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def clear(self, provider, key):
+        """Forget the saved state so the next sync starts from scratch"""
+        try:
+            os.remove(self._path(provider, key))
+        except FileNotFoundError:
+            pass
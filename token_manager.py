@@ -0,0 +1,359 @@
+import base64
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import fcntl
+import json
+import os
+import threading
+import time
+
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+import msal
+
+from email_follow_up import credentials_key
+from worker_local import PerProcess, start_daemon
+
+# Refresh tokens this many seconds before they expire, so a report never starts
+# with a token that runs out halfway through
+DEFAULT_REFRESH_MARGIN = 600
+# Seconds between checks for tokens that are due for a refresh
+DEFAULT_REFRESH_INTERVAL = 60
+# Accounts that haven't asked for a token in this many seconds are no longer refreshed
+DEFAULT_IDLE_TTL = 3600
+
+
+class TokenError(Exception):
+    """A token could not be acquired and the user has to connect the account again"""
+
+
+def credentials_to_dict(credentials):
+    return {
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token,
+        'token_uri': credentials.token_uri,
+        'client_id': credentials.client_id,
+        'client_secret': credentials.client_secret,
+        'scopes': credentials.scopes,
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None
+    }
+
+
+def credentials_from_dict(credentials_dict):
+    # google-auth keeps expiry as a naive UTC datetime
+    expiry = credentials_dict.get('expiry')
+    return Credentials(
+        token=credentials_dict['token'],
+        refresh_token=credentials_dict['refresh_token'],
+        token_uri=credentials_dict['token_uri'],
+        client_id=credentials_dict['client_id'],
+        client_secret=credentials_dict['client_secret'],
+        scopes=credentials_dict['scopes'],
+        expiry=datetime.fromisoformat(expiry) if expiry else None
+    )
+
+
+def gmail_expires_at(credentials):
+    """Expiry of Gmail credentials as a timestamp, or 0 if it isn't known"""
+    if credentials.expiry is None:
+        return 0
+    return credentials.expiry.replace(tzinfo=timezone.utc).timestamp()
+
+
+def outlook_home_account_id(result):
+    """MSAL's ID for the account a token response was issued to, read from the response's client_info"""
+    try:
+        encoded = result['client_info']
+        client_info = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+        return f"{client_info['uid']}.{client_info['utid']}"
+    except (KeyError, TypeError, ValueError):
+        raise TokenError("Signed in, but the token doesn't say which account it belongs to")
+
+
+class _RecordingTokenCache(msal.SerializableTokenCache):
+    """A token cache that remembers the token responses added to it, so they can be added to another cache"""
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def add(self, event, **kwargs):
+        self.events.append((event, kwargs.get('now') or time.time()))
+        super().add(event, **kwargs)
+
+
+class TokenManager:
+    """OAuth tokens for every Gmail and Outlook account this process reports on
+
+    Outlook tokens are kept in an MSAL token cache persisted to a file shared
+    by every worker. Reports read access tokens straight from it. Calls to
+    Microsoft run on a private copy of the cache without holding any lock,
+    and the tokens they return are then added to the latest cache under an
+    exclusive lock on a file next to it, so workers never overwrite each
+    other's tokens. Gmail credentials are kept per account with their expiry.
+    A background thread refreshes tokens of recently used accounts before
+    they expire, so reports get a valid token without waiting for a refresh.
+    """
+    def __init__(self, client_id, client_secret, authority, scopes, redirect_uri, cache_path,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 idle_ttl=DEFAULT_IDLE_TTL):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.authority = authority
+        self.scopes = list(scopes)
+        self.redirect_uri = redirect_uri
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval
+        self.idle_ttl = idle_ttl
+
+        self._lock = threading.RLock()
+        self._msal_app = None
+        self._cache = msal.SerializableTokenCache()
+        self._cache_version = None
+        self._app_pid = None
+        # Calls to Microsoft go one at a time through their own app and cache copy
+        self._network_lock = threading.Lock()
+        self._network_msal_app = None
+        self._network_cache = _RecordingTokenCache()
+        self._network_pid = None
+        self._refresher = PerProcess(lambda: start_daemon(self._refresh_loop, 'token-refresh'))
+        # home_account_id -> [access token expiry, last used]
+        self._outlook_accounts = {}
+        # account key -> [Credentials, last used]
+        self._gmail_credentials = {}
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _cache_lock(self):
+        """Hold the latest token cache against other threads and worker processes, saving it afterwards
+
+        Nothing in here may wait on the network, since every report reads its token under the same lock.
+        """
+        with self._lock:
+            with open(f"{self.cache_path}.lock", 'a') as lock_file:
+                # Closing the file releases the lock
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._load_cache()
+                    yield
+                finally:
+                    # MSAL may have changed the cache even when the call failed
+                    self._save_cache()
+
+    @contextmanager
+    def _network_app(self):
+        """An MSAL app for calls to Microsoft that works on a private copy of the latest token cache
+
+        Tokens it gets are added to the shared cache afterwards, so the shared
+        cache is only locked for as long as that takes.
+        """
+        with self._network_lock:
+            if self._network_msal_app is None or self._network_pid != os.getpid():
+                self._network_cache = _RecordingTokenCache()
+                self._network_msal_app = msal.ConfidentialClientApplication(
+                    self.client_id,
+                    authority=self.authority,
+                    client_credential=self.client_secret,
+                    token_cache=self._network_cache
+                )
+                self._network_pid = os.getpid()
+            try:
+                # Saves swap the file in whole, so it can be read without the lock
+                with open(self.cache_path) as f:
+                    self._network_cache.deserialize(f.read())
+            except FileNotFoundError:
+                self._network_cache.deserialize(None)
+            self._network_cache.events = []
+            try:
+                yield self._network_msal_app
+            finally:
+                if self._network_cache.events:
+                    with self._cache_lock():
+                        for event, now in self._network_cache.events:
+                            self._cache.add(event, now=now)
+
+    def _app(self):
+        """This process's MSAL app, created on first use since it contacts the authority"""
+        # Callers hold the lock
+        if self._msal_app is None or self._app_pid != os.getpid():
+            self._msal_app = msal.ConfidentialClientApplication(
+                self.client_id,
+                authority=self.authority,
+                client_credential=self.client_secret,
+                token_cache=self._cache
+            )
+            self._app_pid = os.getpid()
+        self._load_cache()
+        return self._msal_app
+
+    def _load_cache(self):
+        """Pick up tokens another worker process wrote since we last looked"""
+        try:
+            stat = os.stat(self.cache_path)
+        except OSError:
+            return
+        # Every save swaps in a new file, so the inode changes even within one mtime tick
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version != self._cache_version:
+            with open(self.cache_path) as f:
+                self._cache.deserialize(f.read())
+            self._cache_version = version
+
+    def _save_cache(self):
+        if not self._cache.has_state_changed:
+            return
+        # Write a private temporary file and swap it in, so readers never see half a cache
+        temporary = f"{self.cache_path}.{os.getpid()}.tmp"
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(self._cache.serialize())
+        os.replace(temporary, self.cache_path)
+        self._cache.has_state_changed = False
+        stat = os.stat(self.cache_path)
+        self._cache_version = (stat.st_ino, stat.st_mtime_ns)
+
+    def outlook_authorization_url(self, state):
+        """URL that sends the user to Microsoft to connect their Outlook account"""
+        with self._lock:
+            # MSAL adds the openid, profile and offline_access scopes it needs to track the account
+            return self._app().get_authorization_request_url(
+                self.scopes, state=state, redirect_uri=self.redirect_uri
+            )
+
+    def redeem_outlook_code(self, code):
+        """Exchange an authorization code for tokens and return what the session should keep"""
+        with self._network_app() as app:
+            result = app.acquire_token_by_authorization_code(code, self.scopes, redirect_uri=self.redirect_uri)
+            if 'access_token' not in result:
+                raise TokenError(result.get('error_description') or result.get('error') or 'No token received')
+
+            # The cache holds every user's accounts, so only the one this token was issued to will do
+            home_account_id = outlook_home_account_id(result)
+            accounts = [account for account in app.get_accounts() if account['home_account_id'] == home_account_id]
+        if not accounts:
+            raise TokenError("Signed in, but no account was returned with the token")
+        expires_at = time.time() + int(result.get('expires_in', 0))
+        with self._lock:
+            self._outlook_accounts[home_account_id] = [expires_at, time.time()]
+
+        self.start()
+        return {
+            'home_account_id': home_account_id,
+            'username': accounts[0].get('username'),
+            'expires_at': expires_at
+        }
+
+    def _cached_outlook(self, home_account_id):
+        """The cached access token of an account with the most time left, or None if there isn't one"""
+        credential_type = msal.TokenCache.CredentialType
+        with self._lock:
+            self._load_cache()
+            if not any(self._cache.search(credential_type.ACCOUNT, query={'home_account_id': home_account_id})):
+                raise TokenError("Outlook account is no longer signed in, please connect it again")
+            # Expired tokens are skipped
+            tokens = list(self._cache.search(credential_type.ACCESS_TOKEN, target=self.scopes,
+                                             query={'home_account_id': home_account_id, 'client_id': self.client_id}))
+        if not tokens:
+            return None
+        token = max(tokens, key=lambda token: int(token['expires_on']))
+        return {'access_token': token['secret'], 'expires_in': int(token['expires_on']) - int(time.time())}
+
+    def _refresh_outlook(self, home_account_id):
+        """Get a new access token for an account from Microsoft with its refresh token"""
+        with self._network_app() as app:
+            accounts = [account for account in app.get_accounts() if account['home_account_id'] == home_account_id]
+            if not accounts:
+                raise TokenError("Outlook account is no longer signed in, please connect it again")
+            result = app.acquire_token_silent(self.scopes, account=accounts[0], force_refresh=True)
+        if not result or 'access_token' not in result:
+            error = (result or {}).get('error_description', 'the refresh token was rejected')
+            raise TokenError(f"Outlook token could not be refreshed: {error}")
+        return result
+
+    def outlook_access_token(self, home_account_id):
+        """A valid Outlook access token with at least refresh_margin seconds left"""
+        self.start()
+        result = self._cached_outlook(home_account_id)
+        if result is None or result['expires_in'] < self.refresh_margin:
+            # Normally the background thread got here first
+            result = self._refresh_outlook(home_account_id)
+        with self._lock:
+            self._outlook_accounts[home_account_id] = [time.time() + int(result.get('expires_in', 0)), time.time()]
+        return result['access_token']
+
+    def remove_outlook_account(self, home_account_id):
+        """Forget an account's tokens, as when the user disconnects it"""
+        with self._lock:
+            # Created before taking the file lock, since the first one contacts the authority
+            app = self._app()
+        with self._cache_lock():
+            self._outlook_accounts.pop(home_account_id, None)
+            for account in app.get_accounts():
+                if account['home_account_id'] == home_account_id:
+                    app.remove_account(account)
+
+    def gmail_credentials(self, credentials_dict):
+        """Shared Credentials for a Gmail account, refreshed if they are about to expire"""
+        self.start()
+        credentials = credentials_from_dict(credentials_dict)
+        # Keyed like the reports' own per-account caches
+        key = credentials_key(credentials)
+        with self._lock:
+            entry = self._gmail_credentials.get(key)
+            if entry is None:
+                entry = self._gmail_credentials[key] = [credentials, time.time()]
+            entry[1] = time.time()
+            credentials = entry[0]
+
+        # Normally the background thread got here first; unknown expiry is treated as due
+        if credentials.refresh_token and gmail_expires_at(credentials) - time.time() < self.refresh_margin:
+            self._refresh_gmail(credentials)
+        return credentials
+
+    def _refresh_gmail(self, credentials):
+        try:
+            credentials.refresh(Request())
+        except RefreshError as e:
+            raise TokenError(f"Gmail token could not be refreshed, please connect the account again: {str(e)}")
+
+    def refresh_due(self):
+        """Refresh every recently used token that expires within refresh_margin"""
+        now = time.time()
+        with self._lock:
+            for accounts in (self._outlook_accounts, self._gmail_credentials):
+                for key in [key for key, entry in accounts.items() if now - entry[1] > self.idle_ttl]:
+                    del accounts[key]
+            outlook_due = [home_account_id for home_account_id, (expires_at, _) in self._outlook_accounts.items()
+                           if expires_at - now < self.refresh_margin]
+            gmail_due = [(key, credentials) for key, (credentials, _) in self._gmail_credentials.items()
+                         if credentials.refresh_token and gmail_expires_at(credentials) - now < self.refresh_margin]
+
+        for home_account_id in outlook_due:
+            try:
+                result = self._refresh_outlook(home_account_id)
+                with self._lock:
+                    if home_account_id in self._outlook_accounts:
+                        self._outlook_accounts[home_account_id][0] = time.time() + int(result.get('expires_in', 0))
+            except Exception as e:
+                print(f"Error refreshing Outlook token: {str(e)}")
+                with self._lock:
+                    self._outlook_accounts.pop(home_account_id, None)
+        for key, credentials in gmail_due:
+            try:
+                self._refresh_gmail(credentials)
+            except Exception as e:
+                print(f"Error refreshing Gmail token: {str(e)}")
+                with self._lock:
+                    self._gmail_credentials.pop(key, None)
+
+    def start(self):
+        """Start this process's refresh thread, unless it is already running"""
+        self._refresher.get()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh_due()
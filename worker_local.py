@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import threading
+
+# Threads, event loops and database connections don't survive a fork, so every
+# gunicorn worker process has to make its own
+
+
+class PerProcess:
+    """A value made on first use in each process, such as a background thread's handle"""
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._value = self.factory()
+                self._pid = os.getpid()
+            return self._value
+
+
+def start_daemon(target, name):
+    """Start target on a daemon thread and return the thread"""
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class SQLiteConnections:
+    """Connections to an SQLite database shared by every worker process on the host
+
+    The database runs in WAL mode so readers never wait for a writer. Each
+    thread gets its own connection, since sqlite3 connections can't be shared
+    across threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self):
+        """This thread's connection"""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db